@@ -0,0 +1,27 @@
+import asyncio
+import logging
+from typing import Awaitable, TypeVar
+from ai_tools.downloader import downloader
+from ai_tools.redis_pool import redis_pool
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def run_async(awaitable: Awaitable[T]) -> T:
+    """
+    `asyncio.run` for synchronous callers such as Celery tasks.
+
+    The Redis pool and download session are kept per event loop, so the ones
+    this loop opened are closed before it ends instead of leaking sockets.
+    """
+    async def main():
+        try:
+            return await awaitable
+        finally:
+            for result in await asyncio.gather(redis_pool.close(), downloader.close(), return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to close a connection pool: {result}")
+
+    return asyncio.run(main())
@@ -0,0 +1,59 @@
+import os
+import logging
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+logger = logging.getLogger(__name__)
+
+# chunk size and overlap in tokens; embedding-001 accepts at most 2048 tokens per text
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# chunks handed to the embedding stage at a time; bounds how much text is held in memory
+CHUNK_BATCH_SIZE = int(os.getenv("CHUNK_BATCH_SIZE", "400"))
+# rough size of a Gemini token, used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+class Chunker:
+    """
+    Token-aware text chunker shared by vector ingestion and the LLM tasks.
+
+    Pages are consumed lazily, one at a time, so a loader's `lazy_load()`
+    can stream a large document through without holding every page at once.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE_TOKENS, chunk_overlap: int = CHUNK_OVERLAP_TOKENS):
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=count_tokens, add_start_index=True
+        )
+
+    def split(self, pages: Iterable[Document]) -> Iterator[Document]:
+        """Yield chunks page by page, keeping each page's metadata."""
+        for page in pages:
+            if page.page_content.strip():
+                yield from self.splitter.split_documents([page])
+
+    async def abatches(self, pages: AsyncIterable[Document], size: int = CHUNK_BATCH_SIZE) -> AsyncIterator[List[Document]]:
+        """Yield lists of at most `size` chunks of the pages produced by an async loader."""
+        batch = []
+        async for page in pages:
+            for chunk in self.split([page]):
+                batch.append(chunk)
+                if len(batch) == size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
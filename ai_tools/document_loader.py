@@ -0,0 +1,87 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Type
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
+from langchain_community.document_loaders import TextLoader, Docx2txtLoader
+from ai_tools.downloader import Downloader, downloader as default_downloader
+from ai_tools.pdf_extraction import ParallelPDFLoader
+
+logger = logging.getLogger(__name__)
+
+# threads that parse documents, shared by every loader in the process
+LOADER_WORKERS = int(os.getenv("DOCUMENT_LOADER_WORKERS", "4"))
+
+LOADERS = {
+    ".pdf": ParallelPDFLoader,
+    ".txt": TextLoader,
+    ".docx": Docx2txtLoader,
+}
+
+_executor = ThreadPoolExecutor(max_workers=LOADER_WORKERS, thread_name_prefix="document-loader")
+# PyMuPDF is not thread-safe, so every PDF in the process is parsed on this one thread
+_pdf_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-loader")
+_DONE = object()
+
+
+def is_url(path: str) -> bool:
+    return path.startswith("http://") or path.startswith("https://")
+
+
+def loader_class_for(file_path: str) -> Type[BaseLoader]:
+    for ext, loader_class in LOADERS.items():
+        if file_path.lower().endswith(ext):
+            return loader_class
+    raise ValueError("Unsupported file format")
+
+
+def loader_for(file_path: str) -> BaseLoader:
+    return loader_class_for(file_path)(file_path)
+
+
+class AsyncDocumentLoader:
+    """
+    Loads local files or URLs without blocking the event loop.
+
+    URLs are awaited through the shared downloader and parsing runs in a
+    worker thread pool, one page at a time, so pages are yielded to the
+    caller as soon as they are extracted. PDFs all go through a single
+    thread of their own.
+    """
+
+    def __init__(self, downloader: Downloader = default_downloader, executor: ThreadPoolExecutor = _executor,
+                 pdf_executor: ThreadPoolExecutor = _pdf_executor):
+        self.downloader = downloader
+        self.executor = executor
+        self.pdf_executor = pdf_executor
+
+    async def pages(self, source: str) -> AsyncIterator[Document]:
+        """Yield the documents (pages) of a local path or URL."""
+        # Fail on unsupported formats before downloading anything
+        loader_class = loader_class_for(source.split("?")[0])
+        executor = self.pdf_executor if loader_class is ParallelPDFLoader else self.executor
+
+        temp_file = None
+        if is_url(source):
+            source = temp_file = await self.downloader.download(source)
+
+        loop = asyncio.get_running_loop()
+        try:
+            pages = await loop.run_in_executor(executor, lambda: iter(loader_for(source).lazy_load()))
+            while True:
+                page = await loop.run_in_executor(executor, next, pages, _DONE)
+                if page is _DONE:
+                    break
+                yield page
+        finally:
+            if temp_file and os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    async def text(self, source: str) -> str:
+        """Return the whole text of a local path or URL."""
+        return "\n".join([page.page_content async for page in self.pages(source)])
+
+
+document_loader = AsyncDocumentLoader()
@@ -0,0 +1,103 @@
+import os
+import uuid
+import asyncio
+import logging
+import tempfile
+import weakref
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# refuse to download documents larger than this many bytes
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# seconds; the total timeout covers a single attempt
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "120"))
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "10"))
+# keep-alive connections shared by all downloads of a process
+DOWNLOAD_POOL_SIZE = int(os.getenv("DOWNLOAD_POOL_SIZE", "20"))
+# attempts resumed with a Range request after a dropped connection
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+
+
+class DownloadTooLarge(ValueError):
+    pass
+
+
+class Downloader:
+    """
+    Streams remote files to disk through one pooled `aiohttp` session.
+
+    Responses are written in `chunk_size` pieces instead of being buffered,
+    downloads larger than `max_bytes` are aborted, and an interrupted
+    transfer is resumed with a `Range` request when the server supports it.
+    A `ClientSession` belongs to one event loop, so a session is kept per loop.
+    """
+
+    def __init__(self, max_bytes: int = DOWNLOAD_MAX_BYTES, chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                 timeout: float = DOWNLOAD_TIMEOUT, connect_timeout: float = DOWNLOAD_CONNECT_TIMEOUT,
+                 pool_size: int = DOWNLOAD_POOL_SIZE, retries: int = DOWNLOAD_RETRIES):
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self.pool_size = pool_size
+        self.retries = retries
+        self._sessions = weakref.WeakKeyDictionary()
+
+    def _session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            session = self._sessions[loop] = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return session
+
+    async def close(self) -> None:
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    @staticmethod
+    def temp_path(url: str) -> str:
+        """A fresh temporary path ending with the URL's file name, so loaders can pick by extension."""
+        name = url.split("?")[0].split("/")[-1].lower()
+        return os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}.{name}")
+
+    async def download(self, url: str, path: str = None, max_bytes: int = None) -> str:
+        """Download `url` to `path` (a temporary file by default) and return the path."""
+        path = path or self.temp_path(url)
+        max_bytes = max_bytes or self.max_bytes
+        written = 0
+        try:
+            for attempt in range(self.retries + 1):
+                headers = {"Range": f"bytes={written}-"} if written else {}
+                try:
+                    async with self._session().get(url, headers=headers) as response:
+                        response.raise_for_status()
+                        if written and response.status != 206:
+                            # The server ignored the range; start over
+                            written = 0
+                        expected = response.content_length
+                        if expected is not None and written + expected > max_bytes:
+                            raise DownloadTooLarge(f"{url} is {written + expected} bytes, the limit is {max_bytes}")
+
+                        with open(path, "ab" if written else "wb") as f:
+                            async for chunk in response.content.iter_chunked(self.chunk_size):
+                                written += len(chunk)
+                                if written > max_bytes:
+                                    raise DownloadTooLarge(f"{url} is larger than the {max_bytes} byte limit")
+                                f.write(chunk)
+                    logger.info(f"Downloaded {written} bytes from {url}")
+                    return path
+                except (aiohttp.ClientPayloadError, aiohttp.ServerDisconnectedError, asyncio.TimeoutError) as e:
+                    if attempt == self.retries:
+                        raise
+                    logger.warning(f"Download of {url} interrupted after {written} bytes ({e}), resuming")
+                    await asyncio.sleep(2 ** attempt)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+
+downloader = Downloader()
@@ -0,0 +1,163 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import unicodedata
+import numpy as np
+import redis
+from typing import Dict, List, Optional
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# "disk", "redis" or "off"
+EMBED_CACHE = os.getenv("EMBED_CACHE", "disk")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embedding_cache.sqlite3")
+# least recently used entries beyond this bound are evicted
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    """Content address of a chunk: the embedding model plus the sha256 of its normalized text."""
+    return f"{model}:{hashlib.sha256(normalize_text(text).encode()).hexdigest()}"
+
+
+class EmbeddingCache:
+    """Base class for embedding caches keyed by `cache_key`; counts hits and misses."""
+
+    def __init__(self, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        try:
+            found = self._get_many(keys)
+        except Exception as e:
+            # The cache only saves provider calls; an unavailable backend is a miss
+            logger.error(f"Failed to read embedding cache: {e}")
+            found = {}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries: Dict[str, np.ndarray]) -> None:
+        if not entries:
+            return
+        try:
+            self._put_many(entries)
+        except Exception as e:
+            logger.error(f"Failed to write embedding cache: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def _get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        raise NotImplementedError
+
+    def _put_many(self, entries: Dict[str, np.ndarray]) -> None:
+        raise NotImplementedError
+
+
+class DiskEmbeddingCache(EmbeddingCache):
+    """
+    SQLite-backed cache shared by every process on the host.
+
+    Each entry stores its last use time; inserts evict the least recently
+    used rows once the table grows past `max_entries`.
+    """
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        super().__init__(max_entries)
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call, so the cache can be used from any worker thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._connect() as conn:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                found.update((key, np.frombuffer(vector, dtype="float32")) for key, vector in rows)
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE embeddings SET used = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def _put_many(self, entries: Dict[str, np.ndarray]) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype="float32").tobytes(), now) for key, vector in entries.items()],
+            )
+            (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+
+class RedisEmbeddingCache(EmbeddingCache):
+    """
+    Redis-backed cache shared by every host.
+
+    Vectors are stored as raw float32 bytes under `emb:<key>`; a sorted set
+    of last use times drives LRU eviction.
+    """
+
+    LRU_KEY = "emb:lru"
+
+    def __init__(self, client: Optional[redis.Redis] = None, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        super().__init__(max_entries)
+        self.client = client or redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=0)
+
+    def _get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        values = self.client.mget([f"emb:{key}" for key in keys])
+        found = {key: np.frombuffer(value, dtype="float32") for key, value in zip(keys, values) if value is not None}
+        if found:
+            now = time.time()
+            self.client.zadd(self.LRU_KEY, {key: now for key in found})
+        return found
+
+    def _put_many(self, entries: Dict[str, np.ndarray]) -> None:
+        now = time.time()
+        pipe = self.client.pipeline()
+        for key, vector in entries.items():
+            pipe.set(f"emb:{key}", np.asarray(vector, dtype="float32").tobytes())
+        pipe.zadd(self.LRU_KEY, {key: now for key in entries})
+        pipe.zcard(self.LRU_KEY)
+        count = pipe.execute()[-1]
+        if count > self.max_entries:
+            evicted = self.client.zpopmin(self.LRU_KEY, count - self.max_entries)
+            if evicted:
+                self.client.delete(*[f"emb:{key.decode()}" for key, _ in evicted])
+
+
+def embedding_cache_from_env() -> Optional[EmbeddingCache]:
+    if EMBED_CACHE == "disk":
+        return DiskEmbeddingCache()
+    if EMBED_CACHE == "redis":
+        return RedisEmbeddingCache()
+    if EMBED_CACHE != "off":
+        raise ValueError(f"Unknown embedding cache backend {EMBED_CACHE!r}, expected disk, redis or off")
+    return None
@@ -0,0 +1,86 @@
+import os
+import random
+import asyncio
+import logging
+import numpy as np
+from typing import List, Optional
+from asgiref.sync import sync_to_async
+from langchain_core.embeddings import Embeddings
+from ai_tools.embedding_cache import EmbeddingCache, cache_key
+
+logger = logging.getLogger(__name__)
+
+# texts per embedding request; Gemini's batchEmbedContents accepts at most 100
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+# embedding requests in flight at once, sized to the provider QPS quota
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+# seconds before the first retry, doubled on every further attempt
+EMBED_BACKOFF = float(os.getenv("EMBED_BACKOFF", "1.0"))
+
+
+class EmbeddingPipeline:
+    """
+    Embeds texts in provider-sized batches with bounded concurrency.
+
+    The blocking `embed_documents` calls run in worker threads so the event
+    loop stays free. A failed batch is retried with exponential backoff on its
+    own instead of failing the whole document, and vectors come back in the
+    order of the input texts.
+
+    With a cache, texts whose content address is already known (and repeats
+    within the same document) are never sent to the provider.
+    """
+
+    def __init__(self, model: Embeddings, batch_size: int = EMBED_BATCH_SIZE, concurrency: int = EMBED_CONCURRENCY,
+                 max_retries: int = EMBED_MAX_RETRIES, backoff: float = EMBED_BACKOFF,
+                 cache: Optional[EmbeddingCache] = None, model_name: str = None):
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name or getattr(model, "model", type(model).__name__)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype="float32")
+        if self.cache is None:
+            return await self._embed_all(texts)
+
+        keys = [cache_key(self.model_name, text) for text in texts]
+        found = await sync_to_async(self.cache.get_many, thread_sensitive=False)(list(dict.fromkeys(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            vectors = await self._embed_all(list(missing.values()))
+            fresh = dict(zip(missing, vectors))
+            await sync_to_async(self.cache.put_many, thread_sensitive=False)(fresh)
+            found.update(fresh)
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} of {len(texts)} texts reused")
+        return np.stack([found[key] for key in keys])
+
+    async def _embed_all(self, texts: List[str]) -> np.ndarray:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self._embed_batch(semaphore, n, batch) for n, batch in enumerate(batches)))
+        logger.info(f"Embedded {len(texts)} texts in {len(batches)} batches")
+        return np.concatenate(results)
+
+    async def _embed_batch(self, semaphore: asyncio.Semaphore, n: int, batch: List[str]) -> np.ndarray:
+        embed_documents = sync_to_async(self.model.embed_documents, thread_sensitive=False)
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                try:
+                    vectors = await embed_documents(batch)
+                    if len(vectors) != len(batch):
+                        raise ValueError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+                    return np.array(vectors, dtype="float32")
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        logger.error(f"Embedding batch {n} failed after {attempt + 1} attempts: {e}")
+                        raise
+                    delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                    logger.warning(f"Embedding batch {n} failed ({e}), retrying in {delay:.1f}s")
+            # Sleep outside the semaphore so other batches can use the slot
+            await asyncio.sleep(delay)
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import zlib
+import struct
+import logging
+import unicodedata
+import numpy as np
+import redis
+from typing import Iterable, Iterator, List, Optional
+from django.conf import settings
+from langchain_core.documents import Document
+from ai_tools.chunker import Chunker, CHUNK_BATCH_SIZE
+from ai_tools.document_loader import document_loader, loader_for
+from ai_tools.async_runner import run_async
+
+logger = logging.getLogger(__name__)
+
+# "disk" or "redis"
+ARTIFACT_STORE = os.getenv("EXTRACTION_ARTIFACT_STORE", "disk")
+ARTIFACT_DIR = os.getenv("EXTRACTION_ARTIFACT_DIR", "extraction_artifacts")
+# seconds an artifact is kept in Redis
+ARTIFACT_TTL = int(os.getenv("EXTRACTION_ARTIFACT_TTL", str(7 * 24 * 3600)))
+
+MAGIC = b"XART1\0\0\0"
+HEADER = struct.Struct("<I")
+
+
+def normalize_page(text: str) -> str:
+    text = unicodedata.normalize("NFC", text).replace("\x00", "")
+    text = re.sub(r"[ \t\f\v]+", " ", text)
+    return re.sub(r"\n\s*\n\s*\n+", "\n\n", text).strip()
+
+
+def artifact_key(file) -> str:
+    """Artifacts are shared by identical uploads when the content hash is known."""
+    return file.content_hash or f"file-{file.id}"
+
+
+class ExtractionArtifact:
+    """
+    The parsed form of one uploaded file: normalized page text plus chunk boundaries.
+
+    Chunks are stored as (page, start, end) character offsets into the page
+    text, so embedding, question generation, cards and summaries all read the
+    same parse without repeating extraction or splitting.
+    """
+
+    def __init__(self, pages: List[str], chunks: np.ndarray):
+        self.pages = pages
+        self.chunks = chunks
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[Document], chunker: Chunker = None) -> "ExtractionArtifact":
+        chunker = chunker or Chunker()
+        texts, boundaries = [], []
+        for number, page in enumerate(pages):
+            text = normalize_page(page.page_content)
+            texts.append(text)
+            for chunk in chunker.split([Document(page_content=text)]):
+                start = chunk.metadata["start_index"]
+                boundaries.append((number, start, start + len(chunk.page_content)))
+        return cls(texts, np.array(boundaries, dtype=np.int32).reshape(-1, 3))
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def text(self) -> str:
+        return "\n\n".join(self.pages)
+
+    def batches(self, size: int = CHUNK_BATCH_SIZE) -> Iterator[List[Document]]:
+        """Yield the chunks as Documents, building only one batch at a time."""
+        for i in range(0, len(self.chunks), size):
+            yield [
+                Document(page_content=self.pages[page][start:end], metadata={"page": page})
+                for page, start, end in self.chunks[i:i + size].tolist()
+            ]
+
+    def to_bytes(self) -> bytes:
+        page_bytes = [page.encode() for page in self.pages]
+        header = json.dumps({"pages": [len(page) for page in page_bytes], "chunks": len(self.chunks)}).encode()
+        body = HEADER.pack(len(header)) + header + self.chunks.astype("<i4").tobytes() + b"".join(page_bytes)
+        return MAGIC + zlib.compress(body)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ExtractionArtifact":
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not an extraction artifact")
+        body = zlib.decompress(data[len(MAGIC):])
+        (length,) = HEADER.unpack_from(body)
+        header = json.loads(body[HEADER.size:HEADER.size + length])
+        offset = HEADER.size + length
+        chunks = np.frombuffer(body, dtype="<i4", count=3 * header["chunks"], offset=offset).reshape(-1, 3)
+        offset += chunks.nbytes
+        pages = []
+        for size in header["pages"]:
+            pages.append(body[offset:offset + size].decode())
+            offset += size
+        return cls(pages, chunks.astype(np.int32))
+
+
+class ArtifactStore:
+    """Keeps extraction artifacts on local disk or in Redis, keyed by file hash or id."""
+
+    def __init__(self, backend: str = ARTIFACT_STORE, directory: str = ARTIFACT_DIR, ttl: int = ARTIFACT_TTL):
+        if backend not in ("disk", "redis"):
+            raise ValueError(f"Unknown extraction artifact store {backend!r}, expected disk or redis")
+        self.backend = backend
+        self.directory = directory
+        self.ttl = ttl
+        self.chunker = Chunker()
+        self._redis = None
+
+    def _client(self) -> redis.Redis:
+        if self._redis is None:
+            self._redis = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=0)
+        return self._redis
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.xart")
+
+    def get(self, key: str) -> Optional[ExtractionArtifact]:
+        try:
+            if self.backend == "redis":
+                data = self._client().get(f"artifact:{key}")
+            elif os.path.exists(self._path(key)):
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+            else:
+                data = None
+        except Exception as e:
+            logger.error(f"Failed to read extraction artifact {key}: {e}")
+            return None
+        return ExtractionArtifact.from_bytes(data) if data else None
+
+    def put(self, key: str, artifact: ExtractionArtifact) -> None:
+        data = artifact.to_bytes()
+        try:
+            if self.backend == "redis":
+                self._client().set(f"artifact:{key}", data, ex=self.ttl)
+            else:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = f"{self._path(key)}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(key))
+            logger.info(f"Stored extraction artifact {key}: {len(artifact.pages)} pages, {len(artifact)} chunks, {len(data)} bytes")
+        except Exception as e:
+            logger.error(f"Failed to store extraction artifact {key}: {e}")
+
+    def build(self, file_path: str) -> ExtractionArtifact:
+        """Parse a local file."""
+        return ExtractionArtifact.from_pages(loader_for(file_path).lazy_load(), self.chunker)
+
+    async def abuild(self, source: str) -> ExtractionArtifact:
+        """Parse a local file or URL without blocking the event loop."""
+        return ExtractionArtifact.from_pages([page async for page in document_loader.pages(source)], self.chunker)
+
+    async def aget_or_build(self, key: str, source: str) -> ExtractionArtifact:
+        artifact = self.get(key)
+        if artifact is None:
+            artifact = await self.abuild(source)
+            self.put(key, artifact)
+        return artifact
+
+    def get_or_build(self, key: str, source: str) -> ExtractionArtifact:
+        """`aget_or_build` for synchronous callers such as Celery tasks."""
+        return run_async(self.aget_or_build(key, source))
+
+
+artifact_store = ArtifactStore()
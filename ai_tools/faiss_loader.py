@@ -1,19 +1,22 @@
 import os
-import json
-import uuid
-import faiss
+import time
 import numpy as np
 import logging
-import aiohttp
 import asyncio
-import redis
 from typing import List
 from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
-from langchain_core.documents import Document as LangchainDocument
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.document_loaders import PyMuPDFLoader, TextLoader, Docx2txtLoader
 from pinecone import Pinecone
+from ai_tools.vector_shards import ShardRegistry
+from ai_tools.segment_log import SegmentLog, Compactor
+from ai_tools.embedding_pipeline import EmbeddingPipeline
+from ai_tools.embedding_cache import embedding_cache_from_env
+from ai_tools.chunker import Chunker
+from ai_tools.redis_pool import AsyncRedisPool, redis_pool as default_redis_pool
+from ai_tools.async_runner import run_async
+from ai_tools.document_loader import document_loader
+from ai_tools.extraction_artifact import ExtractionArtifact
 from study_tools.models import File, Session
 from django.contrib.auth import get_user_model
 
@@ -25,78 +28,214 @@ API_KEY = os.getenv("GEMNI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_ENV = os.getenv("PINECONE_ENV")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
+# "session" gives every session its own shard, "user" groups a user's sessions into one shard
+SHARD_BY = os.getenv("VECTOR_SHARD_BY", "session")
+# seconds between background merges of delta segments into the base snapshot, 0 disables
+COMPACT_INTERVAL = float(os.getenv("VECTOR_COMPACT_INTERVAL", "30"))
+# seconds between checks for a newer snapshot or segments in long-lived readers
+REFRESH_INTERVAL = float(os.getenv("VECTOR_REFRESH_INTERVAL", "2"))
+# ids per Pinecone fetch or delete request, the most either accepts
+PINECONE_BATCH_SIZE = 1000
 
 class SessionVectorStore:
     """A class to manage document embeddings using FAISS (local) and Pinecone (cloud)."""
     
-    def __init__(self, dim: int = 768, index_path: str = "session_index.faiss", map_path: str = "session_map.json"):
+    def __init__(self, dim: int = 768, index_path: str = "session_index.faiss", map_path: str = "session_map.json",
+                 shard_dir: str = "session_shards", shard_by: str = SHARD_BY, compact_interval: float = COMPACT_INTERVAL,
+                 read_only: bool = False, refresh_interval: float = REFRESH_INTERVAL,
+                 redis_pool: AsyncRedisPool = default_redis_pool):
         self.dim = dim
         self.index_path = index_path
         self.map_path = map_path
-        self.index = faiss.read_index(self.index_path) if os.path.exists(self.index_path) else faiss.IndexIDMap(faiss.IndexFlatL2(self.dim))
-        self.session_map = self._load_map()
+        self.shard_dir = shard_dir
+        self.shard_by = shard_by
+        self.refresh_interval = refresh_interval
+        self.shards = ShardRegistry(self.dim, self.shard_dir, read_only=read_only)
+        self.segments = SegmentLog(self.shard_dir)
+        if not os.path.exists(self.shards.manifest_path):
+            self._migrate_legacy_index()
+        self.applied_seq = self.shards.seq
+        self._seen_stamp = None
+        self._last_refresh = 0.0
+        self.refresh()
+        self.compactor = None
+        self.start_compactor(compact_interval)
         self.embedding_model = GoogleGenerativeAIEmbeddings(
             model="models/embedding-001",
             google_api_key=API_KEY
         )
-        self.redis_client = redis.Redis(
-            host='localhost',
-            port=6379,
-            db=0,
-            decode_responses=True
-        )
+        self.embedder = EmbeddingPipeline(self.embedding_model, cache=embedding_cache_from_env())
+        self.chunker = Chunker()
+        self.redis = redis_pool
         self.pinecone_index = Pinecone(api_key=PINECONE_API_KEY).Index(PINECONE_INDEX_NAME)
 
-    def _load_map(self) -> dict:
-        if os.path.exists(self.map_path):
-            with open(self.map_path, "r") as f:
-                return json.load(f)
-        return {}
-
-    def _save_index(self) -> None:
-        faiss.write_index(self.index, self.index_path)
-        with open(self.map_path, "w") as f:
-            json.dump(self.session_map, f, indent=2)
-
-    async def _download_file(self, url: str) -> str:
-        ext = url.split("?")[0].split("/")[-1].lower()
-        filename = f"/tmp/{uuid.uuid4().hex}.{ext}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                with open(filename, "wb") as f:
-                    f.write(await response.read())
-        return filename
-
-    def _get_loader(self, file_path: str) -> tuple:
-        temp_file = None
-        if file_path.startswith("http://") or file_path.startswith("https://"):
-            loop = asyncio.get_event_loop()
-            file_path = loop.run_until_complete(self._download_file(file_path))
-            temp_file = file_path
-
-        if file_path.endswith(".pdf"):
-            loader = PyMuPDFLoader(file_path)
-        elif file_path.endswith(".txt"):
-            loader = TextLoader(file_path)
-        elif file_path.endswith(".docx"):
-            loader = Docx2txtLoader(file_path)
-        else:
-            if temp_file and os.path.exists(temp_file):
-                os.remove(temp_file)
-            raise ValueError("Unsupported file format")
-        
-        return loader, temp_file
+    def start_compactor(self, interval: float = COMPACT_INTERVAL) -> None:
+        """Fold delta segments into the snapshot from a background thread of this process."""
+        if self.compactor is None and interval:
+            self.compactor = Compactor(self.dim, self.shard_dir, interval=interval)
+            self.compactor.start()
+
+    @property
+    def session_map(self) -> dict:
+        return self.shards.session_map
+
+    def _migrate_legacy_index(self) -> None:
+        with self.segments.locked("compact.lock"):
+            if not os.path.exists(self.shards.manifest_path):
+                writer = ShardRegistry(self.dim, self.shard_dir)
+                self.segments.bootstrap(writer.migrate_legacy_index(self.index_path, self.map_path))
+        self.shards.load()
+
+    def _reload(self) -> None:
+        self.shards.load()
+        self.applied_seq = self.shards.seq
+
+    def _stamp(self) -> tuple:
+        stamps = []
+        for path in (self.shards.manifest_path, self.segments.state_path):
+            try:
+                stat = os.stat(path)
+                # Both files are replaced atomically, so a new inode means a new version.
+                stamps.append((stat.st_ino, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def refresh(self) -> None:
+        """
+        Catch up with delta segments and snapshots written by other processes.
+
+        When the writer has published a new snapshot the registry swaps to it,
+        so long-lived readers see new sessions without restarting.
+        """
+        stamp = self._stamp()
+        if stamp == self._seen_stamp:
+            return
+
+        for _ in range(3):
+            try:
+                if self.shards.read_manifest()["seq"] > self.shards.seq:
+                    # A compaction folded segments into a new snapshot; map it instead.
+                    self._reload()
+                for seq, record, vectors in self.segments.replay(self.applied_seq):
+                    self.shards.apply(record, vectors)
+                    self.applied_seq = seq
+                self._seen_stamp = stamp
+                return
+            except FileNotFoundError:
+                self._reload()
+        logger.warning("Vector store could not catch up with concurrent compactions")
+
+    def _maybe_refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._last_refresh >= self.refresh_interval:
+            self._last_refresh = now
+            self.refresh()
+
+    def _read(self, fn, *args):
+        try:
+            return fn(*args)
+        except FileNotFoundError:
+            self._reload()
+            self.refresh()
+            return fn(*args)
+
+    def _shard_key(self, session_id: str, user_id: int = None) -> str:
+        if self.shard_by == "user" and user_id:
+            return f"user-{user_id}"
+        return session_id
+
+    def _add_vectors(self, session_id: str, embeddings_np: np.ndarray, user_id: int = None) -> None:
+        """Append the vectors as a delta segment; the compactor folds it into the snapshot later."""
+        self.segments.append(
+            {"op": "add", "session_id": session_id, "shard": self._shard_key(session_id, user_id)},
+            embeddings_np,
+        )
+        self.refresh()
+
+    def alias_session(self, source_id: str, session_id: str) -> bool:
+        """
+        Let `session_id` reuse the vectors and chunk texts of `source_id` (a duplicate upload).
+
+        Returns False when the source has no vectors to share, or when
+        `session_id` already has vectors of its own, which an alias would drop.
+        """
+        self.refresh()
+        if source_id not in self.session_map:
+            logger.warning(f"Session {source_id} has no vectors to share with session {session_id}")
+            return False
+        if session_id in self.session_map:
+            logger.warning(f"Session {session_id} already has vectors, not aliasing it to session {source_id}")
+            return False
+
+        self.segments.append({"op": "alias", "session_id": session_id, "source": source_id})
+        self.refresh()
+
+        # Chunk texts are keyed by session; copy them so both sessions can be deleted independently
+        run_async(self._copy_texts(source_id, session_id, len(self.session_map[source_id])))
+
+        logger.info(f"Session {session_id} now shares the vectors of session {source_id}")
+        return True
 
-    async def store_embeddings(self, file_path: str, session_id: str, user_id: int) -> None:
+    async def _copy_texts(self, source_id: str, session_id: str, count: int) -> None:
+        try:
+            client = self.redis.client()
+            texts = await client.mget([f"doc:{source_id}:{i}" for i in range(count)])
+            async with client.pipeline(transaction=False) as pipe:
+                for i, text in enumerate(texts):
+                    if text is not None:
+                        pipe.set(f"doc:{session_id}:{i}", text, ex=30 * 24 * 3600)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to copy document chunks to session {session_id} in Redis: {e}")
+
+    async def _store_texts(self, session_id: str, offset: int, texts: list) -> None:
+        try:
+            async with self.redis.client().pipeline(transaction=False) as pipe:
+                for i, text in enumerate(texts, start=offset):
+                    pipe.set(f"doc:{session_id}:{i}", text, ex=30 * 24 * 3600)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to store text in Redis: {e}")
+
+    def search(self, session_id: str, query_embedding: np.ndarray, k: int) -> tuple:
+        """
+        Search the shard of a single session and return FAISS-style (distances, ids).
+        """
+        self._maybe_refresh()
+        return self._read(self.shards.search, session_id, query_embedding, k)
+
+    def chunk_index(self, session_id: str, faiss_id: int) -> int:
+        """Position of a FAISS id within its session, as used by the `doc:{session}:{i}` keys."""
+        return faiss_id - self.session_map[session_id].start
+
+    def stats(self) -> dict:
+        """Storage codec, vector count and on-disk bytes per vector of the current snapshot."""
+        self._maybe_refresh()
+        return self.shards.stats()
+
+    async def _chunk_batches(self, file_path: str, artifact: ExtractionArtifact = None):
+        if artifact is not None:
+            for chunks in artifact.batches():
+                yield chunks
+            return
+        async for chunks in self.chunker.abatches(document_loader.pages(file_path)):
+            yield chunks
+
+    async def store_embeddings(self, file_path: str, session_id: str, user_id: int,
+                               artifact: ExtractionArtifact = None) -> None:
         """
         Store document embeddings, metadata, and text for a session.
+
+        When the upload was already parsed, pass its extraction `artifact` to
+        reuse its chunks instead of downloading and parsing `file_path` again.
         """
         if not session_id or not isinstance(session_id, str):
             raise ValueError("session_id must be a non-empty string")
         if not user_id or not isinstance(user_id, int):
             raise ValueError("user_id must be a valid integer")
 
+        self.refresh()
         if session_id in self.session_map:
             logger.info(f"Embeddings already exist for session {session_id}")
             return
@@ -104,7 +243,7 @@ class SessionVectorStore:
         User = get_user_model()
         try:
             user = await sync_to_async(User.objects.get)(id=user_id)
-            session = await sync_to_async(Session.objects.get)(session_id=session_id, user=user)
+            session = await sync_to_async(Session.objects.get)(id=session_id, user=user)
         except User.DoesNotExist:
             logger.error(f"User with id {user_id} does not exist")
             raise ValueError(f"User with id {user_id} does not exist")
@@ -112,59 +251,60 @@ class SessionVectorStore:
             logger.error(f"Session with id {session_id} does not exist for user {user_id}")
             raise ValueError(f"Session with id {session_id} does not exist")
 
-        loader, temp_file = self._get_loader(file_path)
-        try:
-            docs: List[LangchainDocument] = loader.load()
-            texts = [doc.page_content for doc in docs]
+        # Store in File model, unless the upload already recorded it
+        if not await sync_to_async(File.objects.filter(session=session, url=file_path).exists)():
+            await sync_to_async(File.objects.create)(session=session, url=file_path)
+            logger.info(f"Stored File entry for session {session_id} with URL {file_path}")
 
-            # Store in File model
-            file_obj, created = await sync_to_async(File.objects.update_or_create)(
-                session=session,
-                defaults={"url": file_path}
-            )
-            logger.info(f"Stored/updated File entry for session {session_id} with URL {file_path}")
+        # Pages are read lazily and chunked in fixed-size batches, so only one
+        # batch of text is held in memory at a time.
+        vectors = []
+        offset = 0
+        async for chunks in self._chunk_batches(file_path, artifact):
+            texts = [chunk.page_content for chunk in chunks]
 
-            # Store text in Redis
-            try:
-                async def execute_pipeline():
-                    pipe = self.redis_client.pipeline()
-                    for i, text in enumerate(texts):
-                        key = f"doc:{session_id}:{i}"
-                        pipe.set(key, text)
-                        pipe.expire(key, 30 * 24 * 3600)
-                    return pipe.execute()
-                await sync_to_async(execute_pipeline)()
-                logger.info(f"Stored {len(texts)} document chunks for session {session_id} in Redis")
-            except Exception as e:
-                logger.error(f"Failed to store text in Redis: {e}")
-
-            embeddings = self.embedding_model.embed_documents(texts)
-            embeddings_np = np.array(embeddings).astype("float32")
-
-            # Store in FAISS
-            start_id = self.index.ntotal
-            faiss_ids = np.array(list(range(start_id, start_id + len(embeddings))), dtype=np.int64)
-            self.index.add_with_ids(embeddings_np, faiss_ids)
-            self.session_map[session_id] = faiss_ids.tolist()
-            self._save_index()
+            # Store text in Redis while the batch is embedded
+            _, embeddings = await asyncio.gather(
+                self._store_texts(session_id, offset, texts), self.embedder.embed(texts)
+            )
+            vectors.append(embeddings)
 
             # Store in Pinecone with text metadata
             batch_size = 100
             pinecone_vectors = [
                 {
                     "id": f"{session_id}_{i}",
-                    "values": embedding,
+                    "values": embedding.tolist(),
                     "metadata": {"session_id": session_id, "text": text[:40000]}
                 }
-                for i, (embedding, text) in enumerate(zip(embeddings_np, texts))
+                for i, (embedding, text) in enumerate(zip(embeddings, texts), start=offset)
             ]
+            upsert = sync_to_async(self.pinecone_index.upsert, thread_sensitive=False)
             for i in range(0, len(pinecone_vectors), batch_size):
-                self.pinecone_index.upsert(vectors=pinecone_vectors[i:i + batch_size])
+                await upsert(vectors=pinecone_vectors[i:i + batch_size])
+            offset += len(texts)
+
+        if not vectors:
+            raise ValueError(f"No text could be extracted from {file_path}")
+        logger.info(f"Stored {offset} document chunks for session {session_id} in Redis")
+
+        # Store in the session's FAISS shard as one contiguous id range
+        embeddings_np = np.concatenate(vectors)
+        self._add_vectors(session_id, embeddings_np, user_id)
+
+        logger.info(f"Stored {len(embeddings_np)} vectors for session {session_id} to FAISS and Pinecone")
 
-            logger.info(f"Stored {len(embeddings)} vectors for session {session_id} to FAISS and Pinecone")
-        finally:
-            if temp_file and os.path.exists(temp_file):
-                os.remove(temp_file)
+    def _pinecone_ids(self, session_id: str) -> List[str]:
+        """
+        Pinecone ids of a session's chunks, in chunk order.
+
+        The session map knows how many chunks a session has; otherwise the ids
+        are listed from Pinecone by prefix.
+        """
+        if session_id in self.session_map:
+            return [f"{session_id}_{i}" for i in range(len(self.session_map[session_id]))]
+        ids = [id for page in self.pinecone_index.list(prefix=f"{session_id}_") for id in page]
+        return sorted(ids, key=lambda id: int(id.rsplit("_", 1)[1]))
 
     def load_embeddings(self, session_id: str) -> np.ndarray:
         if not session_id or not isinstance(session_id, str):
@@ -173,21 +313,20 @@ class SessionVectorStore:
         if session_id in self.session_map:
             ids = self.session_map[session_id]
             logger.info(f"Loading {len(ids)} vectors for session {session_id} from FAISS")
-            return np.array([self.index.reconstruct(i) for i in ids])
+            return self._read(self.shards.reconstruct, session_id)
 
         logger.info(f"FAISS does not have session {session_id}. Falling back to Pinecone...")
-        pinecone_ids = [f"{session_id}_{i}" for i in range(1000)]
-        response = self.pinecone_index.fetch(ids=pinecone_ids)
-        embeddings = [response.vectors[id].values for id in response.vectors if id in response.vectors]
+        embeddings = []
+        pinecone_ids = self._pinecone_ids(session_id)
+        for i in range(0, len(pinecone_ids), PINECONE_BATCH_SIZE):
+            response = self.pinecone_index.fetch(ids=pinecone_ids[i:i + PINECONE_BATCH_SIZE])
+            embeddings.extend(response.vectors[id].values for id in pinecone_ids[i:i + PINECONE_BATCH_SIZE]
+                              if id in response.vectors)
         if not embeddings:
             raise ValueError(f"No embeddings found in Pinecone for session {session_id}")
 
         embeddings_np = np.array(embeddings).astype("float32")
-        start_id = self.index.ntotal
-        faiss_ids = np.array(list(range(start_id, start_id + len(embeddings))), dtype=np.int64)
-        self.index.add_with_ids(embeddings_np, faiss_ids)
-        self.session_map[session_id] = faiss_ids.tolist()
-        self._save_index()
+        self._add_vectors(session_id, embeddings_np)
         logger.info(f"Pulled {len(embeddings)} vectors from Pinecone and cached to FAISS")
         return embeddings_np
 
@@ -197,7 +336,7 @@ class SessionVectorStore:
 
         # Delete from File model
         try:
-            session = await sync_to_async(Session.objects.get)(session_id=session_id)
+            session = await sync_to_async(Session.objects.get)(id=session_id)
             await sync_to_async(File.objects.filter(session=session).delete)()
             logger.info(f"Deleted File entries for session {session_id}")
         except Session.DoesNotExist:
@@ -205,25 +344,28 @@ class SessionVectorStore:
 
         # Delete text from Redis
         try:
-            keys = await sync_to_async(self.redis_client.keys)(f"doc:{session_id}:*")
+            client = self.redis.client()
+            # SCAN instead of KEYS, which blocks the server while it walks every key
+            keys = [key async for key in client.scan_iter(match=f"doc:{session_id}:*", count=1000)]
+            for i in range(0, len(keys), 1000):
+                await client.unlink(*keys[i:i + 1000])
             if keys:
-                await sync_to_async(self.redis_client.delete)(*keys)
                 logger.info(f"Deleted {len(keys)} document chunks for session {session_id} from Redis")
         except Exception as e:
             logger.error(f"Failed to delete text from Redis: {e}")
 
+        self.refresh()
+        # Collected before the session leaves the map, which knows its chunk count
+        pinecone_ids = await sync_to_async(self._pinecone_ids, thread_sensitive=False)(session_id)
         if session_id in self.session_map:
-            faiss_ids = np.array(self.session_map[session_id], dtype=np.int64)
-            self.index.remove_ids(faiss_ids)
-            del self.session_map[session_id]
-            self._save_index()
+            self.segments.append({"op": "delete", "session_id": session_id})
+            self.refresh()
             logger.info(f"Deleted session {session_id} from FAISS")
 
-        pinecone_ids = [f"{session_id}_{i}" for i in range(1000)]
-        response = self.pinecone_index.fetch(ids=pinecone_ids)
-        valid_ids = [id for id in response.vectors if id in response.vectors]
-        if valid_ids:
-            self.pinecone_index.delete(ids=valid_ids)
+        if pinecone_ids:
+            delete = sync_to_async(self.pinecone_index.delete, thread_sensitive=False)
+            for i in range(0, len(pinecone_ids), PINECONE_BATCH_SIZE):
+                await delete(ids=pinecone_ids[i:i + PINECONE_BATCH_SIZE])
             logger.info(f"Deleted session {session_id} from Pinecone")
         else:
             logger.warning(f"No vectors found in Pinecone for session {session_id}")
@@ -235,6 +377,11 @@ class SessionVectorStore:
         if session_id in self.session_map:
             return True
 
+        # It may have been written by another process since we last looked
+        self.refresh()
+        if session_id in self.session_map:
+            return True
+
         try:
             pinecone_ids = [f"{session_id}_0"]
             response = self.pinecone_index.fetch(ids=pinecone_ids)
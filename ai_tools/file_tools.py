@@ -1,16 +1,6 @@
-from io import BytesIO
-from pypdf import PdfReader
 from langchain.docstore.document import Document
+from ai_tools.pdf_extraction import extract_pdf_bytes
 
 
-def load_pdf_to_documents_from_bytes(file_bytes):
-    file_stream = BytesIO(file_bytes)
-    reader = PdfReader(file_stream)
-    
-    documents = []
-    
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text()
-        documents.append(Document(page_content=text, metadata={"page": i}))
-        
-    return documents
+def load_pdf_to_documents_from_bytes(file_bytes) -> list[Document]:
+    return extract_pdf_bytes(file_bytes)
@@ -0,0 +1,230 @@
+import os
+import math
+import faiss
+import logging
+import numpy as np
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# "<min ntotal>:<kind>" steps; a shard is migrated up the ladder once it grows past a step
+INDEX_LADDER = os.getenv("VECTOR_INDEX_LADDER", "0:flat,50000:ivf_flat,1000000:ivf_pq")
+NPROBE = int(os.getenv("VECTOR_NPROBE", "16"))
+EF_SEARCH = int(os.getenv("VECTOR_EF_SEARCH", "64"))
+HNSW_M = int(os.getenv("VECTOR_HNSW_M", "32"))
+# dimensions per PQ sub-quantizer, 768 / 8 = 96 bytes per vector
+PQ_DIMS_PER_SUBQUANTIZER = int(os.getenv("VECTOR_PQ_DSUB", "8"))
+# upper bound on vectors used to train IVF centroids and PQ codebooks
+MAX_TRAIN_VECTORS = int(os.getenv("VECTOR_MAX_TRAIN", "100000"))
+# how vectors are stored in flat, IVF and HNSW shards: float32, sq8, fp16 or pq
+STORAGE = os.getenv("VECTOR_STORAGE", "float32")
+# fetch k * factor candidates from a lossy (sq8/pq) index and re-rank them against a
+# float16 copy of the vectors; 0 disables the side store
+RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "0"))
+# PQ codebooks need 256 centroids per sub-quantizer; smaller shards fall back to fp16
+PQ_MIN_TRAIN = 256 * 39
+
+KINDS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+STORAGES = ("float32", "sq8", "fp16", "pq")
+
+
+def parse_ladder(ladder: str) -> List[Tuple[int, str]]:
+    steps = []
+    for step in ladder.split(","):
+        threshold, kind = step.strip().split(":")
+        if kind not in KINDS:
+            raise ValueError(f"Unknown index kind {kind!r}, expected one of {', '.join(KINDS)}")
+        steps.append((int(threshold), kind))
+    return sorted(steps)
+
+
+class IndexFactory:
+    """
+    Builds the FAISS index used for a shard and picks its kind from the shard size.
+
+    Small shards stay exact (`flat`); once a shard grows past a ladder step it
+    is retrained as an approximate index (IVF-Flat, IVF-PQ or HNSW). `nprobe`
+    and `ef_search` trade recall for latency at query time.
+
+    Independently of the kind, `storage` picks how vectors are encoded: plain
+    float32, 8-bit scalar quantization, float16 or product quantization.
+    """
+
+    def __init__(self, dim: int, ladder: str = INDEX_LADDER, nprobe: int = NPROBE, ef_search: int = EF_SEARCH,
+                 hnsw_m: int = HNSW_M, pq_dsub: int = PQ_DIMS_PER_SUBQUANTIZER, max_train: int = MAX_TRAIN_VECTORS,
+                 storage: str = STORAGE, rerank_factor: int = RERANK_FACTOR):
+        if storage not in STORAGES:
+            raise ValueError(f"Unknown vector storage {storage!r}, expected one of {', '.join(STORAGES)}")
+        self.dim = dim
+        self.ladder = parse_ladder(ladder)
+        self.storage = storage
+        self.rerank_factor = rerank_factor
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.hnsw_m = hnsw_m
+        self.pq_m = max(1, dim // pq_dsub)
+        self.max_train = max_train
+
+    def kind_for(self, ntotal: int) -> str:
+        kind = self.ladder[0][1]
+        for threshold, step_kind in self.ladder:
+            if ntotal >= threshold:
+                kind = step_kind
+        return kind
+
+    def nlist_for(self, ntotal: int) -> int:
+        # ~4 * sqrt(n) lists, with enough training points (39 per centroid) for each
+        return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+
+    def codec_for(self, kind: str, ntotal: int) -> str:
+        if kind == "ivf_pq":
+            return "pq"
+        if self.storage == "pq" and ntotal < PQ_MIN_TRAIN:
+            return "fp16"
+        return self.storage
+
+    @property
+    def reranks(self) -> bool:
+        """Whether shards keep a float16 side store to re-rank lossy search results."""
+        return self.rerank_factor > 0 and self.storage in ("sq8", "pq")
+
+    def description(self, kind: str, ntotal: int, codec: str = None) -> str:
+        codec = codec or self.codec_for(kind, ntotal)
+        codes = {"float32": "Flat", "sq8": "SQ8", "fp16": "SQfp16", "pq": f"PQ{self.pq_m}"}[codec]
+        if kind == "flat":
+            # IndexPQ rejects search parameters, so a PQ "flat" shard is one IVF list scanned exhaustively
+            return f"IVF1,{codes}" if codec == "pq" else f"IDMap2,{codes}"
+        if kind == "hnsw":
+            return f"IDMap2,HNSW{self.hnsw_m}_PQ{self.pq_m}" if codec == "pq" else f"IDMap2,HNSW{self.hnsw_m},{codes}"
+        if kind in ("ivf_flat", "ivf_pq"):
+            return f"IVF{self.nlist_for(ntotal)},{codes}"
+        raise ValueError(f"Unknown index kind {kind!r}")
+
+    def new_index(self, kind: str = "flat", ntotal: int = 0, codec: str = None) -> faiss.Index:
+        index = faiss.index_factory(self.dim, self.description(kind, ntotal, codec))
+        ivf = self._ivf(index)
+        if ivf is not None:
+            # Lets IVF shards reconstruct and remove by arbitrary FAISS id
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+
+    def build(self, kind: str, vectors: np.ndarray, ids: np.ndarray, codec: str = None) -> faiss.Index:
+        """Build (and train, when the kind needs it) an index holding `vectors`."""
+        index = self.new_index(kind, len(vectors), codec)
+        if not index.is_trained:
+            sample = vectors
+            if len(vectors) > self.max_train:
+                sample = vectors[np.random.default_rng(0).choice(len(vectors), self.max_train, replace=False)]
+            index.train(sample)
+        if len(vectors):
+            index.add_with_ids(vectors, ids)
+        return index
+
+    @staticmethod
+    def _ivf(index: faiss.Index) -> Optional[faiss.IndexIVF]:
+        try:
+            return faiss.extract_index_ivf(index)
+        except RuntimeError:
+            return None
+
+    @staticmethod
+    def _codec_of(codes: faiss.Index) -> str:
+        if isinstance(codes, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+            return "pq"
+        if isinstance(codes, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+            return "fp16" if codes.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+        return "float32"
+
+    def describe(self, index: faiss.Index) -> Tuple[str, str]:
+        """Return the (kind, storage codec) of an index."""
+        index = faiss.downcast_index(index)
+        if isinstance(index, faiss.IndexIVF) and index.nlist == 1:
+            return "flat", self._codec_of(index)
+        if isinstance(index, faiss.IndexIVFPQ):
+            return "ivf_pq", "pq"
+        if isinstance(index, faiss.IndexIVF):
+            return "ivf_flat", self._codec_of(index)
+        if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            inner = faiss.downcast_index(index.index)
+            if isinstance(inner, faiss.IndexHNSW):
+                return "hnsw", self._codec_of(faiss.downcast_index(inner.storage))
+            return "flat", self._codec_of(inner)
+        return "flat", self._codec_of(index)
+
+    def kind_of(self, index: faiss.Index) -> str:
+        return self.describe(index)[0]
+
+    def bytes_per_vector(self, index: faiss.Index) -> float:
+        """Serialized size of the index divided by the vectors it holds."""
+        return len(faiss.serialize_index(index)) / max(index.ntotal, 1)
+
+    def contents(self, index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (vectors, ids) of every entry in the index."""
+        index = faiss.downcast_index(index)
+        ivf = self._ivf(index)
+        if ivf is not None:
+            invlists = ivf.invlists
+            ids = np.concatenate([
+                faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+                for l in range(invlists.nlist)
+            ] or [np.empty(0, dtype=np.int64)])
+            vectors = index.reconstruct_batch(ids) if len(ids) else np.empty((0, self.dim), dtype="float32")
+            return vectors, ids
+
+        ids = faiss.vector_to_array(index.id_map)
+        return faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal), ids
+
+    def remove_ids(self, index: faiss.Index, ids: np.ndarray) -> faiss.Index:
+        """Remove ids, rebuilding index types (HNSW) that cannot delete in place."""
+        kind, codec = self.describe(index)
+        if kind != "hnsw":
+            index.remove_ids(ids)
+            return index
+        vectors, current = self.contents(index)
+        keep = ~np.isin(current, ids)
+        return self.build("hnsw", vectors[keep], current[keep], codec)
+
+    def maybe_migrate(self, index: faiss.Index, source: Tuple[np.ndarray, np.ndarray] = None) -> faiss.Index:
+        """
+        Rebuild the index when it has outgrown its ladder kind or uses another storage codec.
+
+        `source` optionally supplies (vectors, ids) that are more exact than
+        what the index itself can reconstruct, e.g. the float16 side store.
+        """
+        current_kind, current_codec = self.describe(index)
+        kinds = [kind for _, kind in self.ladder]
+        kind = self.kind_for(index.ntotal)
+        if current_kind in kinds and kinds.index(kind) < kinds.index(current_kind):
+            kind = current_kind
+        codec = self.codec_for(kind, index.ntotal)
+        # Flat PQ shards written as IDMap2,PQ cannot be searched with parameters; rebuild them as IVF1,PQ
+        legacy_pq = current_codec == "pq" and self._ivf(index) is None and current_kind == "flat"
+        if (kind, codec) == (current_kind, current_codec) and not legacy_pq:
+            return index
+
+        vectors, ids = source if source is not None else self.contents(index)
+        logger.info(f"Migrating shard of {index.ntotal} vectors from {current_kind}/{current_codec} to {kind}/{codec}")
+        return self.build(kind, vectors, ids, codec)
+
+    def rerank(self, query: np.ndarray, labels: np.ndarray, side_store: faiss.Index, k: int) -> tuple:
+        """
+        Re-score candidate ids with exact L2 distances against the float16 side store.
+        """
+        distances = np.full((len(query), k), np.inf, dtype="float32")
+        ranked = np.full((len(query), k), -1, dtype=np.int64)
+        for row, (vector, candidates) in enumerate(zip(query, labels)):
+            candidates = candidates[candidates != -1]
+            if not len(candidates):
+                continue
+            exact = ((side_store.reconstruct_batch(candidates) - vector) ** 2).sum(axis=1)
+            order = np.argsort(exact)[:k]
+            distances[row, :len(order)] = exact[order]
+            ranked[row, :len(order)] = candidates[order]
+        return distances, ranked
+
+    def search_params(self, index: faiss.Index, sel: Optional[faiss.IDSelector] = None) -> faiss.SearchParameters:
+        if self._ivf(index) is not None:
+            return faiss.SearchParametersIVF(sel=sel, nprobe=self.nprobe)
+        if self.kind_of(index) == "hnsw":
+            return faiss.SearchParametersHNSW(sel=sel, efSearch=self.ef_search)
+        return faiss.SearchParameters(sel=sel)
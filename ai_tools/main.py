@@ -20,10 +20,13 @@ class AI(BaseClient):
         self.session_vector_stores = {}
         self.user_memories = {}
 
-    def run(self, path, task="summerize"):
+    def run(self, path=None, task="summerize", artifact=None):
         '''
         path:
             path to the file to be used
+
+        artifact:
+            an already parsed ExtractionArtifact, used instead of extracting `path` again
         
         task:
             the task to be performed
@@ -33,8 +36,11 @@ class AI(BaseClient):
                         "study-card"
         '''
 
-        text = self.extract(path)
-        t = "".join([tex.page_content for tex in text])
+        if artifact is not None:
+            t = artifact.text()
+        else:
+            text = self.extract(path)
+            t = "".join([tex.page_content for tex in text])
         docs = [Document(page_content=t)]
         result = None
         
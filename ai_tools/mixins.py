@@ -1,6 +1,6 @@
 from django.conf import settings
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from ai_tools.pdf_extraction import ParallelPDFLoader
+from ai_tools.chunker import Chunker
 from langchain_community.vectorstores import FAISS
 from langchain_google_genai import GoogleGenerativeAI
 import pickle
@@ -10,15 +10,11 @@ class BaseClient:
     api_key = settings.GOOGLE_API_KEY
     model = 'gemini-2.0-flash'
     llm = GoogleGenerativeAI(model=model, google_api_key=api_key, verbose=True)
+    chunker = Chunker()
 
     def extract(self, file_path):
-        loader = PyPDFLoader(file_path)
-        documents = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=600, chunk_overlap=200
-        )
-        texts = text_splitter.split_documents(documents)
-        return texts
+        loader = ParallelPDFLoader(file_path)
+        return list(self.chunker.split(loader.lazy_load()))
 
 
     def parse_json_like_content(self, input_text):
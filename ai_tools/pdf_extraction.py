@@ -0,0 +1,117 @@
+import os
+import logging
+import tempfile
+from typing import Iterator, List, Tuple
+import billiard
+import fitz
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# PDFs at least this large are extracted by the process pool; smaller ones serially
+PDF_PARALLEL_MIN_BYTES = int(os.getenv("PDF_PARALLEL_MIN_BYTES", str(5 * 1024 * 1024)))
+# extraction processes per Celery worker process; every prefork child has its own pool, so keep this small
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "2"))
+# pages handed to a worker at a time
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "32"))
+
+_pool_enabled = False
+_pool = None
+
+
+def _extract_range(task: Tuple[str, int, int]) -> List[str]:
+    path, start, stop = task
+    with fitz.open(path) as pdf:
+        return [pdf[number].get_text() for number in range(start, stop)]
+
+
+def enable_process_pool() -> None:
+    """
+    Allow large PDFs to be extracted by a process pool in this process.
+
+    Called when a Celery worker process starts; web and ASGI processes never
+    enable it and extract serially.
+    """
+    global _pool_enabled
+    _pool_enabled = True
+
+
+def close_process_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+
+def _get_pool():
+    global _pool
+    if not _pool_enabled:
+        return None
+    if _pool is None:
+        # billiard, unlike multiprocessing, lets daemonic Celery prefork children start processes;
+        # spawn, so workers do not inherit the parent's threads, locks and connections
+        _pool = billiard.get_context("spawn").Pool(processes=PDF_EXTRACT_WORKERS)
+    return _pool
+
+
+def _page_ranges(page_count: int, size: int) -> List[Tuple[int, int]]:
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def extract_pdf_pages(path: str, parallel_min_bytes: int = PDF_PARALLEL_MIN_BYTES) -> Iterator[Document]:
+    """
+    Yield one Document per PDF page, in page order.
+
+    In Celery workers, files of at least `parallel_min_bytes` have their page
+    ranges split across a process pool; the pages are still yielded in order.
+    """
+    with fitz.open(path) as pdf:
+        page_count = pdf.page_count
+    metadata = {"source": path, "file_path": path, "total_pages": page_count}
+
+    pool = _get_pool() if os.path.getsize(path) >= parallel_min_bytes and page_count > PDF_PAGES_PER_TASK else None
+    if pool is None:
+        with fitz.open(path) as pdf:
+            for number in range(page_count):
+                yield Document(page_content=pdf[number].get_text(), metadata=dict(metadata, page=number))
+        return
+
+    ranges = _page_ranges(page_count, max(PDF_PAGES_PER_TASK, -(-page_count // (PDF_EXTRACT_WORKERS * 4))))
+    logger.info(f"Extracting {page_count} pages of {path} in {len(ranges)} parallel tasks")
+    texts = pool.imap(_extract_range, [(path, start, stop) for start, stop in ranges])
+    for (start, _), page_texts in zip(ranges, texts):
+        for offset, text in enumerate(page_texts):
+            yield Document(page_content=text, metadata=dict(metadata, page=start + offset))
+
+
+def extract_pdf_bytes(file_bytes: bytes, parallel_min_bytes: int = PDF_PARALLEL_MIN_BYTES) -> List[Document]:
+    """`extract_pdf_pages` for an in-memory PDF."""
+    if len(file_bytes) < parallel_min_bytes:
+        with fitz.open(stream=file_bytes, filetype="pdf") as pdf:
+            return [
+                Document(page_content=page.get_text(), metadata={"page": number, "total_pages": pdf.page_count})
+                for number, page in enumerate(pdf)
+            ]
+
+    # Workers open the file by path instead of receiving a copy of the bytes
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(file_bytes)
+    try:
+        documents = list(extract_pdf_pages(f.name, parallel_min_bytes))
+    finally:
+        os.remove(f.name)
+    for document in documents:
+        document.metadata = {"page": document.metadata["page"], "total_pages": document.metadata["total_pages"]}
+    return documents
+
+
+class ParallelPDFLoader(BaseLoader):
+    """LangChain loader over `extract_pdf_pages`."""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def lazy_load(self) -> Iterator[Document]:
+        return extract_pdf_pages(self.file_path)
@@ -0,0 +1,53 @@
+import os
+import asyncio
+import logging
+import weakref
+import redis.asyncio as aioredis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# connections per event loop shared by every async Redis user in the process
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+# seconds to wait for a free connection before failing
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+
+
+class AsyncRedisPool:
+    """
+    Hands out `redis.asyncio` clients backed by one bounded connection pool.
+
+    asyncio connections belong to the event loop that opened them, so a pool
+    is kept per loop: the Channels loop shares one across all sockets, and
+    synchronous callers go through `async_runner.run_async`, which closes the
+    pool of its short-lived loop.
+    """
+
+    def __init__(self, host: str = None, port: int = None, db: int = 0,
+                 max_connections: int = REDIS_MAX_CONNECTIONS, timeout: float = REDIS_POOL_TIMEOUT):
+        self.host = host or settings.REDIS_HOST or "localhost"
+        self.port = int(port or settings.REDIS_PORT or 6379)
+        self.db = db
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._clients = weakref.WeakKeyDictionary()
+
+    def client(self) -> aioredis.Redis:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            pool = aioredis.BlockingConnectionPool(
+                host=self.host, port=self.port, db=self.db, decode_responses=True,
+                max_connections=self.max_connections, timeout=self.timeout,
+            )
+            client = self._clients[loop] = aioredis.Redis(connection_pool=pool)
+        return client
+
+    async def close(self) -> None:
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+            await client.connection_pool.disconnect()
+
+
+redis_pool = AsyncRedisPool()
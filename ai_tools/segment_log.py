@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import fcntl
+import struct
+import logging
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+from ai_tools.vector_shards import ShardRegistry
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<I")
+
+
+class SegmentLog:
+    """
+    Append-only delta segments for the sharded vector store.
+
+    Every write (new vectors or a session tombstone) becomes one small
+    `<seq>.seg` file: a length-prefixed JSON record followed by the raw float32
+    vectors. Sequence numbers and FAISS ids are allocated under a file lock so
+    several Celery workers can append concurrently.
+    """
+
+    def __init__(self, shard_dir: str):
+        self.segment_dir = os.path.join(shard_dir, "segments")
+        self.state_path = os.path.join(self.segment_dir, "STATE")
+        os.makedirs(self.segment_dir, exist_ok=True)
+
+    @contextmanager
+    def locked(self, name: str, blocking: bool = True):
+        with open(os.path.join(self.segment_dir, name), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.segment_dir, f"{seq:012d}.seg")
+
+    def read_state(self) -> dict:
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        return {"seq": 0, "next_id": 0}
+
+    def _write_state(self, state: dict) -> None:
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def bootstrap(self, next_id: int) -> None:
+        """Seed the id counter, e.g. after migrating a legacy index."""
+        with self.locked("append.lock"):
+            state = self.read_state()
+            state["next_id"] = max(state["next_id"], next_id)
+            self._write_state(state)
+
+    def append(self, record: dict, vectors: Optional[np.ndarray] = None) -> dict:
+        """
+        Durably append one record and return it with its `seq` (and id range for adds).
+        """
+        with self.locked("append.lock"):
+            state = self.read_state()
+            record = dict(record, seq=state["seq"] + 1)
+            if record["op"] == "add":
+                record["start"] = state["next_id"]
+                record["count"] = len(vectors)
+                state["next_id"] += len(vectors)
+
+            header = json.dumps(record).encode()
+            tmp_path = f"{self._path(record['seq'])}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(HEADER.pack(len(header)))
+                f.write(header)
+                if vectors is not None:
+                    f.write(np.ascontiguousarray(vectors, dtype="float32").tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(record["seq"]))
+
+            state["seq"] = record["seq"]
+            self._write_state(state)
+        return record
+
+    def read(self, seq: int) -> Tuple[dict, Optional[np.ndarray]]:
+        with open(self._path(seq), "rb") as f:
+            (length,) = HEADER.unpack(f.read(HEADER.size))
+            record = json.loads(f.read(length))
+            payload = f.read()
+        vectors = np.frombuffer(payload, dtype="float32").reshape(record["count"], -1) if payload else None
+        return record, vectors
+
+    def pending(self, after_seq: int) -> List[int]:
+        return list(range(after_seq + 1, self.read_state()["seq"] + 1))
+
+    def replay(self, after_seq: int) -> Iterator[Tuple[int, dict, Optional[np.ndarray]]]:
+        """
+        Yield every segment newer than `after_seq` in order.
+
+        Raises FileNotFoundError if a compaction removed a segment the caller
+        has not seen yet, meaning it has to reload the snapshot first.
+        """
+        for seq in self.pending(after_seq):
+            record, vectors = self.read(seq)
+            yield seq, record, vectors
+
+    def remove(self, upto_seq: int) -> None:
+        for name in os.listdir(self.segment_dir):
+            if name.endswith(".seg") and int(name[:-4]) <= upto_seq:
+                os.remove(os.path.join(self.segment_dir, name))
+
+
+def compact(dim: int, shard_dir: str, min_segments: int = 1) -> int:
+    """
+    Merge pending delta segments into a new base snapshot.
+
+    Only the shards touched by the pending segments are rewritten. Returns the
+    snapshot sequence number after compaction.
+    """
+    log = SegmentLog(shard_dir)
+    with log.locked("compact.lock", blocking=False) as acquired:
+        if not acquired:
+            return -1
+
+        snapshot = ShardRegistry(dim, shard_dir)
+        pending = log.pending(snapshot.seq)
+        if len(pending) < min_segments:
+            return snapshot.seq
+
+        started = time.monotonic()
+        # Only the segments counted above; one appended meanwhile waits for the next round
+        for seq in pending:
+            snapshot.apply(*log.read(seq))
+        obsolete = snapshot.write_snapshot(pending[-1])
+
+        log.remove(pending[-1])
+        for filename in obsolete:
+            path = os.path.join(shard_dir, filename)
+            if os.path.exists(path):
+                os.remove(path)
+
+        logger.info(f"Compacted {len(pending)} segments into snapshot {snapshot.seq} in {time.monotonic() - started:.2f}s")
+        return snapshot.seq
+
+
+class Compactor(threading.Thread):
+    """Background thread that periodically folds delta segments into the base snapshot."""
+
+    def __init__(self, dim: int, shard_dir: str, interval: float = 30.0, min_segments: int = 1):
+        super().__init__(name="vector-compactor", daemon=True)
+        self.dim = dim
+        self.shard_dir = shard_dir
+        self.interval = interval
+        self.min_segments = min_segments
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                compact(self.dim, self.shard_dir, self.min_segments)
+            except Exception as e:
+                logger.error(f"Vector store compaction failed: {e}")
+
+    def stop(self) -> None:
+        self._stopped.set()
@@ -0,0 +1,166 @@
+import struct
+import numpy as np
+from array import array
+from typing import Dict, Iterator, List, Optional
+
+MAGIC = b"SMAP1\0\0\0"
+# v2 adds (alias, owner) pairs after the sessions
+MAGIC_V2 = b"SMAP2\0\0\0"
+COUNT = struct.Struct("<Q")
+
+
+class RangeSessionMap:
+    """
+    Maps every session to the contiguous range of FAISS ids it owns.
+
+    Ids are handed out in increasing order, so ranges are stored as two
+    append-only int64 arrays (start, count) plus a session -> slot dict. A
+    session's ids come back as a `range`, and the owner of a FAISS id is found
+    with a binary search over the starts instead of scanning every session.
+
+    A session can also be an alias of another one (a duplicate upload of the
+    same document); it shares the owner's range instead of getting its own.
+    """
+
+    def __init__(self):
+        self._slots: Dict[str, int] = {}
+        self._sessions: List[Optional[str]] = []
+        self._starts = array("q")
+        self._counts = array("q")
+        self._aliases: Dict[str, str] = {}
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._slots or session_id in self._aliases
+
+    def __len__(self) -> int:
+        return len(self._slots) + len(self._aliases)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __getitem__(self, session_id: str) -> range:
+        slot = self._slots[self.owner(session_id)]
+        return range(self._starts[slot], self._starts[slot] + self._counts[slot])
+
+    def get(self, session_id: str, default=None):
+        return self[session_id] if session_id in self else default
+
+    def keys(self):
+        return list(self._slots) + list(self._aliases)
+
+    def items(self):
+        return ((session_id, self[session_id]) for session_id in self.keys())
+
+    def owner(self, session_id: str) -> str:
+        """The session whose range `session_id` uses: itself, or the session it aliases."""
+        return self._aliases.get(session_id, session_id)
+
+    def aliases_of(self, session_id: str) -> List[str]:
+        return [alias for alias, owner in self._aliases.items() if owner == session_id]
+
+    def add(self, session_id: str, start: int, count: int) -> None:
+        if self._starts and start < self._starts[-1]:
+            raise ValueError(f"FAISS id range for session {session_id} starts before the last allocated range")
+        self.pop(session_id)
+        self._slots[session_id] = len(self._sessions)
+        self._sessions.append(session_id)
+        self._starts.append(start)
+        self._counts.append(count)
+
+    def alias(self, session_id: str, source_id: str) -> None:
+        """Make `session_id` share the id range of `source_id`."""
+        owner = self.owner(source_id)
+        if owner not in self._slots:
+            raise KeyError(source_id)
+        self.pop(session_id)
+        self._aliases[session_id] = owner
+
+    def pop(self, session_id: str, default=None):
+        """
+        Remove a session and return the ids that are no longer referenced.
+
+        Removing an alias, or an owner that still has aliases, frees no ids:
+        in the latter case the first alias takes over the range.
+        """
+        if self._aliases.pop(session_id, None) is not None:
+            return range(0)
+        slot = self._slots.pop(session_id, None)
+        if slot is None:
+            return default
+        heirs = self.aliases_of(session_id)
+        if heirs:
+            heir = heirs[0]
+            del self._aliases[heir]
+            for alias in heirs[1:]:
+                self._aliases[alias] = heir
+            self._slots[heir] = slot
+            self._sessions[slot] = heir
+            return range(0)
+        ids = range(self._starts[slot], self._starts[slot] + self._counts[slot])
+        # Leave a tombstone so the starts stay sorted; it is dropped on save.
+        self._sessions[slot] = None
+        self._counts[slot] = 0
+        return ids
+
+    def session_for(self, faiss_id: int) -> Optional[str]:
+        """Return the session owning a FAISS id (never an alias), or None."""
+        starts = np.frombuffer(self._starts, dtype=np.int64)
+        slot = int(np.searchsorted(starts, faiss_id, side="right")) - 1
+        if slot < 0 or faiss_id >= self._starts[slot] + self._counts[slot]:
+            return None
+        return self._sessions[slot]
+
+    @classmethod
+    def load(cls, path: str) -> "RangeSessionMap":
+        session_map = cls()
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(MAGIC)] not in (MAGIC, MAGIC_V2):
+            raise ValueError(f"{path} is not a session map file")
+
+        offset = len(MAGIC)
+        (n,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        n_aliases = 0
+        if data[:len(MAGIC)] == MAGIC_V2:
+            (n_aliases,) = COUNT.unpack_from(data, offset)
+            offset += COUNT.size
+        starts = np.frombuffer(data, dtype="<i8", count=n, offset=offset)
+        offset += 8 * n
+        counts = np.frombuffer(data, dtype="<i8", count=n, offset=offset)
+        offset += 8 * n
+        lengths = np.frombuffer(data, dtype="<u4", count=n + 2 * n_aliases, offset=offset)
+        offset += 4 * (n + 2 * n_aliases)
+        names = data[offset:].decode()
+
+        session_map._starts.frombytes(starts.tobytes())
+        session_map._counts.frombytes(counts.tobytes())
+        position = 0
+        strings = []
+        for length in lengths.tolist():
+            strings.append(names[position:position + length])
+            position += length
+        for slot, session_id in enumerate(strings[:n]):
+            session_map._sessions.append(session_id)
+            session_map._slots[session_id] = slot
+        pairs = strings[n:]
+        session_map._aliases = dict(zip(pairs[0::2], pairs[1::2]))
+        return session_map
+
+    def save(self, path: str) -> None:
+        live = [slot for slot, session_id in enumerate(self._sessions) if session_id is not None]
+        names = [self._sessions[slot] for slot in live]
+        starts = np.array([self._starts[slot] for slot in live], dtype="<i8")
+        counts = np.array([self._counts[slot] for slot in live], dtype="<i8")
+        for alias, owner in self._aliases.items():
+            names += [alias, owner]
+        lengths = np.array([len(name) for name in names], dtype="<u4")
+
+        with open(path, "wb") as f:
+            f.write(MAGIC_V2)
+            f.write(COUNT.pack(len(live)))
+            f.write(COUNT.pack(len(self._aliases)))
+            f.write(starts.tobytes())
+            f.write(counts.tobytes())
+            f.write(lengths.tobytes())
+            f.write("".join(names).encode())
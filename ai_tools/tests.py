@@ -0,0 +1,157 @@
+import os
+import tempfile
+from unittest import mock
+import faiss
+import numpy as np
+from django.test import SimpleTestCase
+from ai_tools.index_factory import IndexFactory, KINDS, STORAGES, PQ_MIN_TRAIN
+from ai_tools.segment_log import SegmentLog, compact
+from ai_tools.vector_shards import ShardRegistry
+
+
+class IndexFactoryTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(0)
+        # enough vectors to train PQ codebooks, so pq storage is not replaced by fp16
+        cls.vectors = rng.random((PQ_MIN_TRAIN + 16, 16), dtype="float32")
+        cls.ids = np.arange(len(cls.vectors), dtype=np.int64)
+
+    def test_every_kind_and_storage_searches_with_and_without_a_selector(self):
+        for storage in STORAGES:
+            factory = IndexFactory(16, storage=storage, pq_dsub=8)
+            for kind in KINDS:
+                with self.subTest(storage=storage, kind=kind):
+                    index = factory.build(kind, self.vectors, self.ids)
+                    _, labels = index.search(self.vectors[:2], 5, params=factory.search_params(index))
+                    self.assertTrue((labels >= 0).all())
+
+                    selector = faiss.IDSelectorRange(100, 200)
+                    _, labels = index.search(self.vectors[:2], 5, params=factory.search_params(index, selector))
+                    found = labels[labels >= 0]
+                    self.assertTrue(((found >= 100) & (found < 200)).all())
+
+                    if kind == "flat":
+                        # a flat shard stays flat in its configured storage instead of being migrated again
+                        self.assertEqual(factory.describe(index), ("flat", storage))
+                        self.assertIs(factory.maybe_migrate(index), index)
+
+    def test_legacy_flat_pq_shard_is_rebuilt(self):
+        factory = IndexFactory(16, storage="pq", pq_dsub=8)
+        legacy = faiss.index_factory(16, "IDMap2,PQ2")
+        legacy.train(self.vectors)
+        legacy.add_with_ids(self.vectors, self.ids)
+        migrated = factory.maybe_migrate(legacy)
+        self.assertIsNotNone(factory._ivf(migrated))
+        migrated.search(self.vectors[:1], 3, params=factory.search_params(migrated, faiss.IDSelectorRange(0, 10)))
+
+
+class SegmentLogTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.shard_dir = tmp.name
+        self.log = SegmentLog(self.shard_dir)
+        self.rng = np.random.default_rng(0)
+
+    def _add(self, session_id, count=4):
+        vectors = self.rng.random((count, 8), dtype="float32")
+        return self.log.append({"op": "add", "session_id": session_id, "shard": session_id}, vectors), vectors
+
+    def _reader(self):
+        reader = ShardRegistry(8, self.shard_dir, read_only=True)
+        for seq, record, vectors in self.log.replay(reader.seq):
+            reader.apply(record, vectors)
+        return reader
+
+    def test_append_replay_compact_alias_delete_reload(self):
+        first, vectors_a = self._add("a")
+        second, vectors_b = self._add("b")
+        self.assertEqual((first["seq"], first["start"], second["start"]), (1, 0, 4))
+
+        record, vectors = self.log.read(2)
+        self.assertEqual(record, second)
+        np.testing.assert_array_equal(vectors, vectors_b)
+
+        # before any compaction a reader serves the appended vectors from its delta indexes
+        reader = self._reader()
+        _, labels = reader.search("b", vectors_b[:1], 2)
+        self.assertTrue(set(labels[0]) <= {4, 5, 6, 7})
+
+        self.assertEqual(compact(8, self.shard_dir), 2)
+        self.assertEqual(self.log.pending(2), [])
+        self.assertFalse([name for name in os.listdir(self.log.segment_dir) if name.endswith(".seg")])
+
+        self.log.append({"op": "alias", "session_id": "c", "source": "a"})
+        self.log.append({"op": "delete", "session_id": "a"})
+        self.log.append({"op": "delete", "session_id": "b"})
+        self.assertEqual(compact(8, self.shard_dir), 5)
+        manifest = ShardRegistry(8, self.shard_dir).read_manifest()
+        self.assertEqual(set(manifest["shards"]), {"a"})
+        # files of the previous snapshot are gone once nothing points to them
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.shard_dir) if name.endswith((".faiss", ".bin"))),
+            sorted([manifest["shards"]["a"], manifest["map"]]),
+        )
+
+        reader = self._reader()
+        self.assertEqual(reader.seq, 5)
+        self.assertEqual(set(reader.session_map), {"c"})
+        self.assertEqual(reader.session_map["c"], range(0, 4))
+        np.testing.assert_allclose(reader.reconstruct("c"), vectors_a)
+        _, labels = reader.search("c", vectors_a[:1], 1)
+        self.assertEqual(labels[0][0], 0)
+        self.assertEqual(reader.search("b", vectors_b[:1], 1)[1][0][0], -1)
+
+    def test_segment_appended_during_compaction_is_left_for_the_next_round(self):
+        self._add("a")
+        appended = []
+        pending = SegmentLog.pending
+
+        def append_after_listing(log, after_seq):
+            seqs = pending(log, after_seq)
+            if not appended:
+                appended.append(self._add("b"))
+            return seqs
+
+        with mock.patch.object(SegmentLog, "pending", autospec=True, side_effect=append_after_listing):
+            self.assertEqual(compact(8, self.shard_dir), 1)
+        self.assertEqual(self.log.pending(1), [2])
+
+        # the reader replays the newer segment on top of the snapshot exactly once
+        _, vectors = appended[0]
+        _, labels = self._reader().search("b", vectors[:1], 4)
+        self.assertEqual(sorted(labels[0]), [4, 5, 6, 7])
+
+    def test_reader_reloads_after_concurrent_compaction(self):
+        self._add("a")
+        _, vectors = self._add("b")
+        self._add("a")
+        reader = ShardRegistry(8, self.shard_dir, read_only=True)
+        pending = self.log.replay(reader.seq)
+        reader.apply(*next(pending)[1:])
+
+        compact(8, self.shard_dir)
+        # the segments the reader has not applied yet were folded into the snapshot
+        with self.assertRaises(FileNotFoundError):
+            list(pending)
+
+        reader.load()
+        self.assertEqual(reader.seq, 3)
+        self.assertEqual(list(self.log.replay(reader.seq)), [])
+        self.assertEqual(reader.session_map["a"], range(8, 12))
+        self.assertEqual(reader.search("b", vectors[:1], 1)[1][0][0], 4)
+
+        # a second compaction replaces the shard file the reader would load lazily
+        self._add("c")
+        self.log.append({"op": "delete", "session_id": "a"})
+        stale = ShardRegistry(8, self.shard_dir, read_only=True)
+        self._add("a")
+        compact(8, self.shard_dir)
+        with self.assertRaises(FileNotFoundError):
+            stale.get_shard("a")
+        stale.load()
+        self.assertEqual(stale.session_map["a"], range(16, 20))
@@ -0,0 +1,297 @@
+import os
+import json
+import faiss
+import numpy as np
+import logging
+from typing import Dict, List, Optional
+from ai_tools.session_map import RangeSessionMap
+from ai_tools.index_factory import IndexFactory
+
+logger = logging.getLogger(__name__)
+
+
+class ShardRegistry:
+    """
+    Keeps one small FAISS index per shard instead of a single global index.
+
+    A shard is keyed either by the session itself or by a user group. The
+    registry records which shard every session lives in and which FAISS ids it
+    owns, so a query only touches the vectors of the session being asked about.
+
+    On disk the registry is a snapshot described by `manifest.json`; shard and
+    map files carry the segment sequence number they were compacted at, so a
+    new snapshot never overwrites files an older manifest still points to.
+
+    In read-only mode shard files are memory-mapped, so every process reading
+    the same snapshot shares one page-cache copy. Mapped indexes cannot be
+    modified, so changes newer than the snapshot are kept in small in-memory
+    delta indexes that are searched alongside the base.
+
+    When the factory stores vectors lossily and re-ranking is enabled, every
+    shard also gets a float16 side store (`rerank` in the manifest) that is
+    used to re-score the candidates returned by the quantized index.
+    """
+
+    def __init__(self, dim: int, shard_dir: str, read_only: bool = False, factory: IndexFactory = None):
+        self.dim = dim
+        self.shard_dir = shard_dir
+        self.read_only = read_only
+        self.factory = factory or IndexFactory(dim)
+        self.manifest_path = os.path.join(self.shard_dir, "manifest.json")
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.load()
+
+    def load(self) -> None:
+        """(Re)load the snapshot described by the manifest and drop cached shards."""
+        manifest = self.read_manifest()
+        self.seq: int = manifest["seq"]
+        self.files: Dict[str, str] = manifest["shards"]
+        self.registry: Dict[str, str] = manifest["registry"]
+        self.map_file: Optional[str] = manifest["map"]
+        self.rerank_files: Dict[str, str] = manifest.get("rerank", {})
+        self.session_map: RangeSessionMap = self._load_map()
+        self._shards: Dict[str, faiss.Index] = {}
+        self._side_stores: Dict[str, faiss.Index] = {}
+        self._deltas: Dict[str, faiss.Index] = {}
+        self._dirty = set()
+
+    def read_manifest(self) -> dict:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        return {"seq": 0, "shards": {}, "registry": {}, "map": None, "rerank": {}}
+
+    def _load_map(self) -> RangeSessionMap:
+        if self.map_file:
+            return RangeSessionMap.load(self._path(self.map_file))
+        return RangeSessionMap()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.shard_dir, filename)
+
+    def _new_index(self, codec: str = "float32") -> faiss.Index:
+        # Shards are re-encoded with the configured storage when they are compacted
+        return self.factory.new_index("flat", codec=codec)
+
+    def shard_for(self, session_id: str) -> Optional[str]:
+        return self.registry.get(session_id)
+
+    def get_shard(self, shard_key: str, create: bool = False) -> Optional[faiss.Index]:
+        """
+        Return the index of a shard, loading it from disk on first use.
+
+        Raises FileNotFoundError when a compaction elsewhere has already
+        replaced the snapshot file; callers reload the registry and retry.
+        """
+        return self._load(self._shards, self.files, shard_key, create, "float32")
+
+    def get_side_store(self, shard_key: str, create: bool = False) -> Optional[faiss.Index]:
+        """Return the float16 re-rank copy of a shard, or None when there is none."""
+        if not self.factory.reranks:
+            return None
+        return self._load(self._side_stores, self.rerank_files, shard_key, create, "fp16")
+
+    def _load(self, cache: Dict[str, faiss.Index], files: Dict[str, str], shard_key: str, create: bool,
+              codec: str) -> Optional[faiss.Index]:
+        if shard_key in cache:
+            return cache[shard_key]
+
+        if shard_key in files:
+            path = self._path(files[shard_key])
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if self.read_only else 0)
+        elif create and not self.read_only:
+            index = self._new_index(codec)
+        else:
+            return None
+
+        cache[shard_key] = index
+        return index
+
+    def apply(self, record: dict, vectors: Optional[np.ndarray] = None) -> None:
+        """Apply one segment record (an add, an alias or a tombstone) to the in-memory state."""
+        session_id = record["session_id"]
+        if record["op"] == "add":
+            if session_id in self.session_map:
+                self.apply({"op": "delete", "session_id": session_id})
+            ids = np.arange(record["start"], record["start"] + record["count"], dtype=np.int64)
+            if self.read_only:
+                index = self._deltas.setdefault(record["shard"], self._new_index())
+            else:
+                index = self.get_shard(record["shard"], create=True)
+                side_store = self.get_side_store(record["shard"], create=True)
+                if side_store is not None:
+                    side_store.add_with_ids(vectors, ids)
+            index.add_with_ids(vectors, ids)
+            self.registry[session_id] = record["shard"]
+            self.session_map.add(session_id, record["start"], record["count"])
+            self._dirty.add(record["shard"])
+        elif record["op"] == "alias":
+            if session_id in self.session_map:
+                self.apply({"op": "delete", "session_id": session_id})
+            source_id = record["source"]
+            if source_id not in self.session_map:
+                logger.warning(f"Cannot alias session {session_id} to missing session {source_id}")
+                return
+            self.registry[session_id] = self.registry[source_id]
+            self.session_map.alias(session_id, source_id)
+            self._dirty.add(self.registry[session_id])
+        elif record["op"] == "delete":
+            shard_key = self.registry.pop(session_id, None)
+            ids = self.session_map.pop(session_id, range(0))
+            if shard_key is None or not ids:
+                # Unknown session, or an alias / aliased owner whose ids are still referenced
+                if shard_key is not None:
+                    self._dirty.add(shard_key)
+                return
+            # A mapped base cannot shrink; searches are restricted to live session ids instead.
+            ids = np.arange(ids.start, ids.stop, dtype=np.int64)
+            if self.read_only:
+                if shard_key in self._deltas:
+                    self._deltas[shard_key].remove_ids(ids)
+            else:
+                index = self.get_shard(shard_key)
+                if index is not None:
+                    self._shards[shard_key] = self.factory.remove_ids(index, ids)
+                side_store = self.get_side_store(shard_key)
+                if side_store is not None:
+                    side_store.remove_ids(ids)
+            self._dirty.add(shard_key)
+
+    def write_snapshot(self, seq: int) -> List[str]:
+        """
+        Persist dirty shards and the session map as a new snapshot at `seq`.
+
+        Returns the files that the previous manifest referenced and the new one
+        no longer does, so the caller can remove them.
+        """
+        if self.read_only:
+            raise ValueError("Cannot write a snapshot from a read-only shard registry")
+
+        previous = set(self.files.values()) | set(self.rerank_files.values()) | ({self.map_file} if self.map_file else set())
+
+        for shard_key in self._dirty:
+            index = self.get_shard(shard_key)
+            side_store = self.get_side_store(shard_key)
+            if index is None or index.ntotal == 0:
+                self.files.pop(shard_key, None)
+                self.rerank_files.pop(shard_key, None)
+                continue
+            source = self.factory.contents(side_store) if side_store is not None and side_store.ntotal else None
+            index = self._shards[shard_key] = self.factory.maybe_migrate(index, source)
+            filename = f"{shard_key}.{seq}.faiss"
+            faiss.write_index(index, self._path(filename))
+            self.files[shard_key] = filename
+            if side_store is not None:
+                filename = f"{shard_key}.{seq}.rerank.faiss"
+                faiss.write_index(side_store, self._path(filename))
+                self.rerank_files[shard_key] = filename
+        self._dirty.clear()
+
+        self.map_file = f"session_map.{seq}.bin"
+        self.session_map.save(self._path(self.map_file))
+
+        self.seq = seq
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"seq": seq, "shards": self.files, "registry": self.registry, "map": self.map_file,
+                       "rerank": self.rerank_files}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+        return sorted(previous - set(self.files.values()) - set(self.rerank_files.values()) - {self.map_file})
+
+    def search(self, session_id: str, query: np.ndarray, k: int) -> tuple:
+        """
+        Search only the shard holding `session_id`, restricted to that session's ids.
+        """
+        shard_key = self.shard_for(session_id)
+        ids = self.session_map.get(session_id, range(0))
+        indexes = [self.get_shard(shard_key), self._deltas.get(shard_key)] if shard_key and ids else []
+        indexes = [index for index in indexes if index is not None and index.ntotal]
+
+        distances = np.full((len(query), k), np.inf, dtype="float32")
+        labels = np.full((len(query), k), -1, dtype=np.int64)
+        if not indexes:
+            return distances, labels
+
+        sel = None
+        if self.read_only or sum(index.ntotal for index in indexes) != len(ids):
+            # Keep other sessions of a shared shard, and sessions deleted after
+            # the mapped snapshot was written, out of the top-k.
+            sel = faiss.IDSelectorRange(ids.start, ids.stop)
+        side_store = self.get_side_store(shard_key)
+        if len(indexes) == 1 and side_store is None:
+            return indexes[0].search(query, k, params=self.factory.search_params(indexes[0], sel))
+
+        for index in indexes:
+            if index is not self._deltas.get(shard_key) and side_store is not None and side_store.ntotal:
+                D, I = index.search(query, k * self.factory.rerank_factor, params=self.factory.search_params(index, sel))
+                D, I = self.factory.rerank(query, I, side_store, k)
+            else:
+                D, I = index.search(query, k, params=self.factory.search_params(index, sel))
+            distances = np.concatenate([distances, D], axis=1)
+            labels = np.concatenate([labels, I], axis=1)
+        order = np.argsort(distances, axis=1)[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    def reconstruct(self, session_id: str) -> np.ndarray:
+        shard_key = self.shard_for(session_id)
+        index = self._deltas.get(shard_key)
+        ids = self.session_map[session_id]
+        if index is None or not index.ntotal or ids.start not in set(faiss.vector_to_array(index.id_map)):
+            # Prefer the float16 side store over lossy quantized codes
+            index = self.get_side_store(shard_key)
+            if index is None or not index.ntotal:
+                index = self.get_shard(shard_key)
+        return np.array([index.reconstruct(int(i)) for i in ids])
+
+    def stats(self) -> dict:
+        """Vector count and on-disk bytes per vector of the current snapshot."""
+        vectors = sum(len(ids) for session_id, ids in self.session_map.items()
+                      if self.session_map.owner(session_id) == session_id)
+        index_bytes = sum(os.path.getsize(self._path(f)) for f in self.files.values() if os.path.exists(self._path(f)))
+        rerank_bytes = sum(
+            os.path.getsize(self._path(f)) for f in self.rerank_files.values() if os.path.exists(self._path(f))
+        )
+        return {
+            "storage": self.factory.storage,
+            "vectors": vectors,
+            "shards": len(self.files),
+            "index_bytes": index_bytes,
+            "rerank_bytes": rerank_bytes,
+            "bytes_per_vector": (index_bytes + rerank_bytes) / vectors if vectors else 0.0,
+        }
+
+    def migrate_legacy_index(self, index_path: str, map_path: str) -> int:
+        """
+        Split a pre-sharding global `IndexIDMap` into per-session shards.
+
+        Sessions get fresh contiguous id ranges; chunk positions within a
+        session, which the Redis and Pinecone keys use, are unchanged.
+        Returns the next free FAISS id.
+        """
+        if not os.path.exists(index_path) or not os.path.exists(map_path):
+            return 0
+
+        with open(map_path, "r") as f:
+            legacy_map = json.load(f)
+        legacy = faiss.read_index(index_path)
+        flat = faiss.downcast_index(legacy.index)
+        vectors = flat.reconstruct_n(0, legacy.ntotal)
+        rows = {int(faiss_id): row for row, faiss_id in enumerate(faiss.vector_to_array(legacy.id_map))}
+
+        next_id = 0
+        for session_id, ids in legacy_map.items():
+            ids = [i for i in ids if i in rows]
+            if not ids:
+                continue
+            self.apply(
+                {"op": "add", "session_id": session_id, "shard": session_id, "start": next_id, "count": len(ids)},
+                vectors[[rows[i] for i in ids]],
+            )
+            next_id += len(ids)
+
+        self.write_snapshot(self.seq)
+        logger.info(f"Migrated {len(self.registry)} sessions from {index_path} into per-session shards")
+        return next_id
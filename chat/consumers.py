@@ -1,12 +1,18 @@
+import os
 import json
+import time
 import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.auth import get_user_model
-from .services import VectorStoreSingleton
-from ai_tools.AI_Chat import AIChat
+from .services import AIChatSingleton
+from study_tools.progress import progress_group
 
 logger = logging.getLogger(__name__)
 
+# streamed deltas are coalesced into frames of at least this many characters or this much time
+STREAM_FLUSH_CHARS = int(os.getenv("CHAT_STREAM_FLUSH_CHARS", "64"))
+STREAM_FLUSH_SECONDS = float(os.getenv("CHAT_STREAM_FLUSH_MS", "50")) / 1000
+
 class AIConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         try:
@@ -17,9 +23,9 @@ class AIConsumer(AsyncWebsocketConsumer):
                 await self.close(code=4403)  # Match JWTAuthMiddleware
                 return
 
+            # Only the user is per connection; the chat chain, Redis pool and vector store are shared
             self.user = user
-            self.vector_store = VectorStoreSingleton.get_instance()
-            self.ai_chat = AIChat(self.vector_store)
+            self.ai_chat = AIChatSingleton.get_instance()
             await self.accept()
             logger.info(f"WebSocket connected for user {user.id}")
         except Exception as e:
@@ -38,18 +44,68 @@ class AIConsumer(AsyncWebsocketConsumer):
             if not query or not document_session_id:
                 error_msg = 'Missing query or document_session_id'
                 logger.warning(f"Invalid input: {error_msg}")
-                await self.send(text_data=json.dumps({'error': error_msg}))
+                await self.send(text_data=json.dumps({'type': 'error', 'error': error_msg}))
                 return
 
-            # Process chat query using AIChat
-            response = await self.ai_chat.chat(
-                self.user.id, document_session_id, query
+            # Stream the answer as start, delta... and end frames
+            await self.stream_response(
+                self.ai_chat.stream_chat(self.user.id, document_session_id, query)
             )
-            await self.send(text_data=json.dumps({'message': response}))
             logger.info(f"Sent response for query: {query[:50]}...")
         except ValueError as e:
             logger.error(f"ValueError in receive: {e}")
-            await self.send(text_data=json.dumps({'error': str(e)}))
+            await self.send(text_data=json.dumps({'type': 'error', 'error': str(e)}))
         except Exception as e:
             logger.error(f"Unexpected error in receive: {e}")
-            await self.send(text_data=json.dumps({'error': 'Internal server error'}))
\ No newline at end of file
+            await self.send(text_data=json.dumps({'type': 'error', 'error': 'Internal server error'}))
+
+    async def stream_response(self, deltas):
+        """
+        Forward streamed text in coalesced delta frames and return the whole answer.
+
+        The first delta is sent as soon as it arrives; later ones are batched
+        until STREAM_FLUSH_CHARS characters or STREAM_FLUSH_SECONDS have built up.
+        """
+        parts, pending = [], []
+        last_flush = None
+        async for delta in deltas:
+            if last_flush is None:
+                await self.send(text_data=json.dumps({'type': 'start'}))
+                last_flush = 0.0
+            parts.append(delta)
+            pending.append(delta)
+            now = time.monotonic()
+            if len(parts) == 1 or sum(map(len, pending)) >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_SECONDS:
+                await self.send(text_data=json.dumps({'type': 'delta', 'delta': "".join(pending)}))
+                pending, last_flush = [], now
+
+        if last_flush is None:
+            await self.send(text_data=json.dumps({'type': 'start'}))
+        if pending:
+            await self.send(text_data=json.dumps({'type': 'delta', 'delta': "".join(pending)}))
+        response = "".join(parts)
+        await self.send(text_data=json.dumps({'type': 'end', 'message': response}))
+        return response
+
+
+class UploadProgressConsumer(AsyncWebsocketConsumer):
+    """Pushes the processing progress of the user's uploads as each stage starts and finishes."""
+
+    async def connect(self):
+        user = self.scope['user']
+        User = get_user_model()
+        if not isinstance(user, User) or not user.is_authenticated:
+            logger.error("Unauthenticated user attempted WebSocket connection")
+            await self.close(code=4403)
+            return
+
+        self.group_name = progress_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def upload_progress(self, event):
+        await self.send(text_data=json.dumps({key: value for key, value in event.items() if key != 'type'}))
@@ -1,4 +1,5 @@
 from ai_tools.faiss_loader import SessionVectorStore
+from ai_tools.AI_Chat import AIChat
 
 class VectorStoreSingleton:
     _instance = None
@@ -6,5 +7,18 @@ class VectorStoreSingleton:
     @classmethod
     def get_instance(cls):
         if cls._instance is None:
-            cls._instance = SessionVectorStore()
-        return cls._instance
\ No newline at end of file
+            # Memory-map the shards so every process shares one page-cache copy;
+            # compaction is left to the Celery workers that write segments.
+            cls._instance = SessionVectorStore(read_only=True, compact_interval=0)
+        return cls._instance
+
+
+class AIChatSingleton:
+    """One AIChat per process: its Redis pool, compiled chain and vector store are shared by every socket."""
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = AIChat(VectorStoreSingleton.get_instance())
+        return cls._instance
@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     path("study/chat/", consumers.AIConsumer.as_asgi()),
+    path("study/uploads/", consumers.UploadProgressConsumer.as_asgi()),
 ]
\ No newline at end of file
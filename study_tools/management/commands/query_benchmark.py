@@ -0,0 +1,135 @@
+import copy
+import os
+import random
+import time
+import numpy as np
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Count, Q
+from UserAccountManager.models import User
+from study_tools.models import Session, Question, Answer, Card, Course, File, IngestionStage
+
+ALIAS = "benchmark"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a separate local database with generated users, sessions, questions and cards, "
+        "then report the query plan and p50/p99 latency of each list and lookup endpoint's queries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="query_benchmark.sqlite3", help="SQLite file to seed, never the app database")
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--sessions", type=int, default=10, help="sessions (and courses) per user")
+        parser.add_argument("--questions", type=int, default=50, help="questions per session, each with 4 answers")
+        parser.add_argument("--cards", type=int, default=50, help="cards per session")
+        parser.add_argument("--runs", type=int, default=500, help="executions per query")
+        parser.add_argument("--reseed", action="store_true", help="drop an existing benchmark database first")
+
+    def handle(self, *args, **options):
+        path = options["database"]
+        if options["reseed"] and os.path.exists(path):
+            os.remove(path)
+        seeded = os.path.exists(path)
+
+        connections.settings[ALIAS] = dict(copy.deepcopy(connections.settings["default"]), NAME=path)
+        call_command("migrate", database=ALIAS, verbosity=0)
+        if not seeded:
+            self._seed(options)
+
+        self.stdout.write(", ".join(
+            f"{model.__name__}: {model.objects.using(ALIAS).count()}"
+            for model in (User, Session, Course, Question, Answer, Card, File)
+        ))
+        rng = random.Random(0)
+        user_ids = list(User.objects.using(ALIAS).values_list("id", flat=True))
+        sessions = list(Session.objects.using(ALIAS).values_list("id", "user_id"))
+        hashes = list(File.objects.using(ALIAS).values_list("content_hash", flat=True)[:1000])
+
+        self.stdout.write(f"{'query':<24} {'p50 ms':>8} {'p99 ms':>8}")
+        plans = []
+        for name, make_query in self._queries(user_ids, sessions, hashes).items():
+            plans.append((name, make_query(rng).explain()))
+            p50, p99 = self._measure(make_query, rng, options["runs"])
+            self.stdout.write(f"{name:<24} {p50:>8.3f} {p99:>8.3f}")
+        for name, plan in plans:
+            self.stdout.write(f"\n{name}\n{plan}")
+
+    def _queries(self, user_ids, sessions, hashes):
+        db = User.objects.db_manager(ALIAS)
+        return {
+            "login email": lambda rng: db.filter(email=f"user{rng.choice(user_ids)}@example.com"),
+            "session list": lambda rng: (
+                Session.objects.using(ALIAS).filter(user_id=rng.choice(user_ids)).order_by("-created_at", "-id")[:10]
+            ),
+            "course list": lambda rng: (
+                Course.objects.using(ALIAS).filter(user_id=rng.choice(user_ids)).order_by("-created_at")[:10]
+            ),
+            "question page": lambda rng: self._session_page(Question, rng.choice(sessions)),
+            "answers of page": lambda rng: Answer.objects.using(ALIAS).filter(
+                question__in=list(self._session_page(Question, rng.choice(sessions)).values_list("id", flat=True))
+            ),
+            "card page": lambda rng: self._session_page(Card, rng.choice(sessions)),
+            "duplicate upload": lambda rng: (
+                File.objects.using(ALIAS).filter(content_hash=rng.choice(hashes)).exclude(url="")
+                .annotate(done_stages=Count("stages", filter=Q(stages__status=IngestionStage.Status.DONE)))
+                .filter(done_stages=len(IngestionStage.Name.choices))
+                .order_by("created_at")[:1]
+            ),
+        }
+
+    def _session_page(self, model, session):
+        session_id, user_id = session
+        return (
+            model.objects.using(ALIAS).filter(session__id=session_id, session__user_id=user_id)
+            .order_by("created_at", "id")[:10]
+        )
+
+    def _measure(self, make_query, rng, runs):
+        latencies = []
+        for _ in range(runs):
+            query = make_query(rng)
+            started = time.perf_counter()
+            list(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+        return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+    def _seed(self, options):
+        started = time.perf_counter()
+        batch = 5000
+        for first in range(0, options["users"], 1000):
+            # one transaction per thousand users instead of a commit per insert
+            with transaction.atomic(using=ALIAS):
+                users = User.objects.using(ALIAS).bulk_create([
+                    User(email=f"user{first + i + 1}@example.com", password="!")
+                    for i in range(min(1000, options["users"] - first))
+                ], batch_size=batch)
+                Course.objects.using(ALIAS).bulk_create([
+                    Course(user=user, title=f"course {j}") for user in users for j in range(options["sessions"])
+                ], batch_size=batch)
+                sessions = Session.objects.using(ALIAS).bulk_create([
+                    Session(user=user, name=f"session {j}") for user in users for j in range(options["sessions"])
+                ], batch_size=batch)
+
+                for session in sessions:
+                    questions = Question.objects.using(ALIAS).bulk_create([
+                        Question(session=session, question_text=f"question {j}") for j in range(options["questions"])
+                    ], batch_size=batch)
+                    Answer.objects.using(ALIAS).bulk_create([
+                        Answer(question=question, content=f"answer {j}", is_correct=j == 0)
+                        for question in questions for j in range(4)
+                    ], batch_size=batch)
+                    Card.objects.using(ALIAS).bulk_create([
+                        Card(session=session, question=f"card {j}", answer="answer") for j in range(options["cards"])
+                    ], batch_size=batch)
+                files = File.objects.using(ALIAS).bulk_create([
+                    File(session=session, url=f"https://example.com/{session.id}.pdf", content_hash=f"{session.id:064x}")
+                    for session in sessions
+                ], batch_size=batch)
+                IngestionStage.objects.using(ALIAS).bulk_create([
+                    IngestionStage(file=file, name=name, status=IngestionStage.Status.DONE)
+                    for file in files for name, _ in IngestionStage.Name.choices
+                ], batch_size=batch)
+            self.stdout.write(f"seeded {first + len(users)} users in {time.perf_counter() - started:.0f}s")
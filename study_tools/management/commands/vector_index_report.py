@@ -0,0 +1,92 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from ai_tools.index_factory import IndexFactory, PQ_MIN_TRAIN, STORAGES
+from ai_tools.vector_shards import ShardRegistry
+
+
+class Command(BaseCommand):
+    help = "Report recall, size and latency of each FAISS index kind and storage codec on the vectors in the shard store"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shard-dir", default="session_shards")
+        parser.add_argument("--dim", type=int, default=768)
+        parser.add_argument("--sample", type=int, default=50000, help="vectors to index")
+        parser.add_argument("--queries", type=int, default=200, help="held-out vectors used as queries")
+        parser.add_argument("-k", type=int, default=3)
+        parser.add_argument("--nprobe", default="1,4,16,64")
+        parser.add_argument("--ef-search", default="16,64,256")
+        parser.add_argument("--storage", default=",".join(STORAGES), help="storage codecs to compare")
+        parser.add_argument("--rerank", type=int, default=4, help="candidate factor for float16 re-ranking, 0 skips")
+
+    def handle(self, *args, **options):
+        factory = IndexFactory(options["dim"])
+        vectors = self._load_vectors(options["shard_dir"], options["dim"], factory)
+        if len(vectors) <= options["queries"]:
+            raise CommandError(f"Need more than {options['queries']} stored vectors, found {len(vectors)}")
+
+        rng = np.random.default_rng(0)
+        vectors = vectors[rng.permutation(len(vectors))[:options["sample"] + options["queries"]]]
+        queries, base = vectors[:options["queries"]], vectors[options["queries"]:]
+        ids = np.arange(len(base), dtype=np.int64)
+        k = options["k"]
+
+        exact = factory.build("flat", base, ids, codec="float32")
+        _, truth = exact.search(queries, k)
+        side_store = factory.build("flat", base, ids, codec="fp16") if options["rerank"] else None
+
+        self.stdout.write(f"{len(base)} vectors, {len(queries)} queries, recall@{k}")
+        self.stdout.write(
+            f"{'index':<10} {'storage':<12} {'setting':<14} {'recall':>7} {'bytes/vec':>10} {'p50 ms':>8} {'p99 ms':>8}"
+        )
+        for storage in options["storage"].split(","):
+            if storage == "pq" and len(base) < PQ_MIN_TRAIN:
+                self.stdout.write(f"skipping pq storage, it needs at least {PQ_MIN_TRAIN} vectors to train")
+                continue
+            for kind in ("flat", "ivf_flat", "hnsw"):
+                index = exact if (kind, storage) == ("flat", "float32") else factory.build(kind, base, ids, storage)
+                size = factory.bytes_per_vector(index)
+                rerank = options["rerank"] if storage in ("sq8", "pq") and side_store is not None else 0
+                for setting in self._settings(kind, options):
+                    if setting:
+                        name, value = setting
+                        setattr(factory, name, value)
+                    label = f"{setting[0]}={setting[1]}" if setting else "-"
+                    recall, p50, p99 = self._measure(factory, index, queries, truth, k)
+                    self.stdout.write(
+                        f"{kind:<10} {storage:<12} {label:<14} {recall:>7.3f} {size:>10.1f} {p50:>8.3f} {p99:>8.3f}"
+                    )
+                    if rerank:
+                        factory.rerank_factor = rerank
+                        recall, p50, p99 = self._measure(factory, index, queries, truth, k, side_store)
+                        reranked_size = size + factory.bytes_per_vector(side_store)
+                        self.stdout.write(
+                            f"{kind:<10} {storage + f'+rr{rerank}':<12} {label:<14} {recall:>7.3f} "
+                            f"{reranked_size:>10.1f} {p50:>8.3f} {p99:>8.3f}"
+                        )
+
+    def _load_vectors(self, shard_dir, dim, factory):
+        registry = ShardRegistry(dim, shard_dir, read_only=True, factory=factory)
+        chunks = [factory.contents(registry.get_shard(shard_key))[0] for shard_key in registry.files]
+        return np.concatenate(chunks) if chunks else np.empty((0, dim), dtype="float32")
+
+    def _settings(self, kind, options):
+        if kind in ("ivf_flat", "ivf_pq"):
+            return [("nprobe", int(value)) for value in options["nprobe"].split(",")]
+        if kind == "hnsw":
+            return [("ef_search", int(value)) for value in options["ef_search"].split(",")]
+        return [None]
+
+    def _measure(self, factory, index, queries, truth, k, side_store=None):
+        params = factory.search_params(index)
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            if side_store is None:
+                _, found = index.search(query[None, :], k, params=params)
+            else:
+                _, found = index.search(query[None, :], k * factory.rerank_factor, params=params)
+                _, found = factory.rerank(query[None, :], found, side_store, k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(set(found[0]) & set(expected))
+        return hits / truth.size, np.percentile(latencies, 50), np.percentile(latencies, 99)
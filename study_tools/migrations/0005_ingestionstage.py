@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('study_tools', '0004_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionStage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(choices=[('upload', 'Upload'), ('embed', 'Embed'), ('questions', 'Questions'), ('cards', 'Cards')], max_length=16)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='study_tools.file')),
+            ],
+            options={
+                'unique_together': {('file', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('study_tools', '0005_ingestionstage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['session', 'created_at', 'id'], name='card_session_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['session', 'created_at', 'id'], name='question_session_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='session_user_created_idx'),
+        ),
+    ]
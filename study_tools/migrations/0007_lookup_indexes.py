@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('study_tools', '0006_list_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['user', '-created_at'], name='course_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['content_hash', 'created_at'], name='file_content_hash_created_idx'),
+        ),
+    ]
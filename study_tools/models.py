@@ -1,3 +1,5 @@
+import os
+import uuid
 from datetime import timedelta
 from django.utils import timezone
 from django.db import models
@@ -15,6 +17,12 @@ class Session(TimeStampMixin, models.Model):
     vector_store_id = models.IntegerField(null = True, blank = True) # for now I made null = true 
     expire_date = models.DateTimeField(default=two_weeks_from_now)
 
+    class Meta:
+        indexes = [
+            # keyset pagination of a user's sessions, newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='session_user_created_idx'),
+        ]
+
     def __str__(self):
         return self.name
     
@@ -23,6 +31,11 @@ class Question(TimeStampMixin, models.Model):
     session = models.ForeignKey(Session, related_name='questions', on_delete=models.CASCADE, null=True, blank=True)
     question_text = models.TextField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'created_at', 'id'], name='question_session_created_idx'),
+        ]
+
     def __str__(self):
         return self.question_text
     
@@ -41,6 +54,11 @@ class Card(TimeStampMixin, models.Model):
     question = models.TextField()
     answer = models.TextField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'created_at', 'id'], name='card_session_created_idx'),
+        ]
+
     def __str__(self):
         return f"Q: {self.question} - A: {self.answer}"
 
@@ -48,17 +66,95 @@ class Card(TimeStampMixin, models.Model):
 class File(TimeStampMixin, models.Model):
     session = models.ForeignKey(Session, related_name='f_session', on_delete=models.CASCADE, null=True, blank=True)
     url = models.URLField()
+    # sha256 of the uploaded bytes, used to reuse the work done for an identical earlier upload
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            # find_duplicate: earliest upload with the same content
+            models.Index(fields=['content_hash', 'created_at'], name='file_content_hash_created_idx'),
+        ]
     
     def __str__(self):
         return self.url
 
 
 
+class IngestionStage(TimeStampMixin, models.Model):
+    """Progress and timing of one processing stage of an uploaded File."""
+
+    class Name(models.TextChoices):
+        UPLOAD = 'upload'
+        EMBED = 'embed'
+        QUESTIONS = 'questions'
+        CARDS = 'cards'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    file = models.ForeignKey(File, related_name='stages', on_delete=models.CASCADE)
+    name = models.CharField(max_length=16, choices=Name.choices)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        unique_together = ('file', 'name')
+
+    @property
+    def duration(self):
+        if self.started_at and self.finished_at:
+            return (self.finished_at - self.started_at).total_seconds()
+        return None
+
+    def __str__(self):
+        return f"{self.file_id} {self.name}: {self.status}"
+
+
+# size of each part of a chunked upload, and the largest file accepted that way
+CHUNKED_UPLOAD_PART_SIZE = int(os.getenv("CHUNKED_UPLOAD_PART_SIZE", str(5 * 1024 * 1024)))
+CHUNKED_UPLOAD_MAX_BYTES = int(os.getenv("CHUNKED_UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+class ChunkedUpload(TimeStampMixin, models.Model):
+    """A resumable upload whose parts are stored on disk until it is completed."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='chunked_uploads', on_delete=models.CASCADE)
+    session = models.ForeignKey(Session, related_name='chunked_uploads', on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    part_size = models.IntegerField()
+    # optional sha256 of the whole file, checked on completion
+    sha256 = models.CharField(max_length=64, blank=True, default="")
+    # part number -> sha256 of the received part
+    parts = models.JSONField(default=dict, blank=True)
+    file = models.ForeignKey(File, related_name='chunked_uploads', on_delete=models.SET_NULL, null=True, blank=True)
+
+    @property
+    def total_parts(self):
+        return max(1, -(-self.size // self.part_size))
+
+    def part_length(self, number):
+        return min(self.part_size, self.size - number * self.part_size)
+
+    def __str__(self):
+        return f"{self.file_name} ({len(self.parts)}/{self.total_parts} parts)"
+
+
 class Course(TimeStampMixin, models.Model):
     title = models.CharField(max_length=255)
     note_content = models.TextField(blank=True, null=True)
     # file = models.FileField(upload_to='uploads')
     user = models.ForeignKey(User, related_name='courses', on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='course_user_created_idx'),
+        ]
+
     def __str__(self):
         return self.title
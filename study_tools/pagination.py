@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+
+
+class NewestFirstPagination(CursorPagination):
+    """
+    Cursor pagination, newest first; every page costs the same as the first.
+
+    DRF keys the cursor on `created_at` alone and steps over rows sharing
+    that timestamp with a small offset; `id` only makes the order stable.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class OldestFirstPagination(NewestFirstPagination):
+    """Generation order, so rows inserted while a client scrolls are appended rather than shifting pages."""
+    ordering = ('created_at', 'id')
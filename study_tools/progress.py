@@ -0,0 +1,86 @@
+import logging
+from contextlib import contextmanager
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.utils import timezone
+from .models import File, IngestionStage
+
+logger = logging.getLogger(__name__)
+
+STAGES = [name for name, _ in IngestionStage.Name.choices]
+
+
+def progress_group(user_id) -> str:
+    """Channels group that receives the upload progress of one user."""
+    return f"uploads_{user_id}"
+
+
+def file_status(stages) -> str:
+    statuses = {stage.status for stage in stages}
+    if IngestionStage.Status.FAILED in statuses:
+        return IngestionStage.Status.FAILED
+    if statuses == {IngestionStage.Status.DONE}:
+        return IngestionStage.Status.DONE
+    if statuses == {IngestionStage.Status.PENDING}:
+        return IngestionStage.Status.PENDING
+    return IngestionStage.Status.RUNNING
+
+
+def stage_data(stage) -> dict:
+    return {
+        "name": stage.name,
+        "status": stage.status,
+        "started_at": stage.started_at.isoformat() if stage.started_at else None,
+        "finished_at": stage.finished_at.isoformat() if stage.finished_at else None,
+        "duration": stage.duration,
+        "error": stage.error,
+    }
+
+
+def notify(file_id) -> None:
+    """Push the current progress of a file to its owner's WebSocket connections."""
+    _file = File.objects.select_related("session").get(id=file_id)
+    stages = list(_file.stages.order_by("id"))
+    message = {
+        "type": "upload.progress",
+        "file_id": _file.id,
+        "session_id": _file.session_id,
+        "status": file_status(stages),
+        "stages": [stage_data(stage) for stage in stages],
+    }
+    try:
+        async_to_sync(get_channel_layer().group_send)(progress_group(_file.session.user_id), message)
+    except Exception as e:
+        logger.error(f"Failed to push progress of file {file_id}: {e}")
+
+
+def create_stages(file_id, status=IngestionStage.Status.PENDING) -> None:
+    now = timezone.now() if status == IngestionStage.Status.DONE else None
+    IngestionStage.objects.bulk_create([
+        IngestionStage(file_id=file_id, name=name, status=status, started_at=now, finished_at=now) for name in STAGES
+    ], ignore_conflicts=True)
+
+
+@contextmanager
+def track_stage(file_id, name):
+    """Record the start, end and any error of a stage, notifying the owner at each change."""
+    stage, _ = IngestionStage.objects.get_or_create(file_id=file_id, name=name)
+    stage.status = IngestionStage.Status.RUNNING
+    stage.started_at = timezone.now()
+    stage.finished_at = None
+    stage.error = ""
+    stage.save(update_fields=["status", "started_at", "finished_at", "error", "updated_at"])
+    notify(file_id)
+    try:
+        yield stage
+    except Exception as e:
+        stage.status = IngestionStage.Status.FAILED
+        stage.error = str(e)
+        raise
+    else:
+        stage.status = IngestionStage.Status.DONE
+    finally:
+        stage.finished_at = timezone.now()
+        stage.save(update_fields=["status", "finished_at", "error", "updated_at"])
+        logger.info(f"File {file_id} stage {name} {stage.status} in {stage.duration:.2f}s")
+        notify(file_id)
@@ -1,8 +1,27 @@
+from django.db import transaction
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
 from ai_tools.main import AI
-from .models import Course, Question, Card, Answer, Session, File
-from .task import upload_file
+from .models import Course, Question, Card, Answer, Session, File, IngestionStage, ChunkedUpload, CHUNKED_UPLOAD_PART_SIZE, CHUNKED_UPLOAD_MAX_BYTES
+from .task import process_upload, find_duplicate, reuse_document
+from .spool import spool_upload
+from .progress import file_status
+
+
+def create_file(upload, **fields):
+    """Create the File for a spooled upload and queue its processing."""
+    instance = File.objects.create(**fields, content_hash=upload["sha256"])
+
+    # Workers read the File row, so only queue them once it is committed
+    duplicate = find_duplicate(upload["sha256"])
+    if duplicate:
+        # The same document was already processed; reuse its chunks, vectors and questions
+        transaction.on_commit(lambda: reuse_document.delay(duplicate.id, instance.id, upload))
+        return instance
+
+    transaction.on_commit(lambda: process_upload(upload, instance.id))
+    return instance
+
 
 class CourseSerializer(serializers.ModelSerializer):
 
@@ -83,9 +102,59 @@ class FileSerializer(serializers.ModelSerializer):
         if not _file:
             raise ValidationError("required file field missing")
         
-        instance = File.objects.create(**validated_data)
-    
-        _file_content = _file.read()
-        upload_file.delay(_file_content, _file.name, instance.id)
+        # Only a reference to the spooled file goes through the broker, never its bytes
+        upload = spool_upload(_file)
+        return create_file(upload, **validated_data)
 
-        return instance
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    total_parts = serializers.IntegerField(read_only=True)
+    received_parts = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ["id", "session", "file_name", "size", "part_size", "sha256", "total_parts", "received_parts", "file"]
+        read_only_fields = ["part_size", "file"]
+
+    def get_received_parts(self, obj):
+        return sorted(int(number) for number in obj.parts)
+
+    def validate_session(self, session):
+        if session.user != self.context['request'].user:
+            raise ValidationError("Unknown session")
+        return session
+
+    def validate_size(self, size):
+        if size <= 0 or size > CHUNKED_UPLOAD_MAX_BYTES:
+            raise ValidationError(f"File size must be between 1 and {CHUNKED_UPLOAD_MAX_BYTES} bytes")
+        return size
+
+    def validate_file_name(self, file_name):
+        if not file_name.lower().endswith((".pdf", ".txt", ".docx")):
+            raise ValidationError("Unsupported file format")
+        return file_name
+
+    def create(self, validated_data):
+        validated_data['user'] = self.context['request'].user
+        validated_data['part_size'] = CHUNKED_UPLOAD_PART_SIZE
+        return super().create(validated_data)
+
+
+class IngestionStageSerializer(serializers.ModelSerializer):
+    duration = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = IngestionStage
+        fields = ['name', 'status', 'started_at', 'finished_at', 'duration', 'error']
+
+
+class FileStatusSerializer(serializers.ModelSerializer):
+    status = serializers.SerializerMethodField()
+    stages = IngestionStageSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = File
+        fields = ['id', 'session', 'url', 'status', 'stages']
+
+    def get_status(self, obj):
+        return file_status(obj.stages.all())
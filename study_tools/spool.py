@@ -0,0 +1,121 @@
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# shared by the web and worker processes (same host or a shared volume)
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", str(settings.BASE_DIR / "upload_spool"))
+
+
+def _spool_path(name: str) -> str:
+    ext = os.path.splitext(name)[1].lower()
+    return os.path.join(UPLOAD_SPOOL_DIR, f"{uuid.uuid4().hex}{ext}")
+
+
+def spool_upload(uploaded_file) -> dict:
+    """
+    Stream an uploaded file into the spool directory and return a reference to it.
+
+    The reference (path, size, sha256, name) is what gets queued; workers read
+    the file from the spool instead of receiving its bytes through the broker.
+    """
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    path = _spool_path(uploaded_file.name)
+    digest = hashlib.sha256()
+    size = 0
+    with open(f"{path}.part", "wb") as f:
+        for chunk in uploaded_file.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.part", path)
+    return {"path": path, "size": size, "sha256": digest.hexdigest(), "name": uploaded_file.name}
+
+
+def spooled_path(upload: dict) -> str:
+    """Return the spooled file's path after checking it is complete."""
+    path = upload["path"]
+    if os.path.dirname(os.path.abspath(path)) != os.path.abspath(UPLOAD_SPOOL_DIR):
+        raise ValueError(f"{path} is not in the upload spool")
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if os.path.getsize(path) != upload["size"]:
+        raise ValueError(f"Spooled upload {path} is {os.path.getsize(path)} bytes, expected {upload['size']}")
+    return path
+
+
+def release(upload: dict) -> None:
+    try:
+        os.remove(upload["path"])
+    except FileNotFoundError:
+        pass
+
+
+def _parts_dir(upload_id) -> str:
+    return os.path.join(UPLOAD_SPOOL_DIR, "parts", str(upload_id))
+
+
+def write_part(upload_id, number: int, stream, length: int, expected_sha256: str = "", chunk_size: int = 64 * 1024) -> str:
+    """
+    Stream one part of a chunked upload to disk and return its sha256.
+
+    Only `chunk_size` bytes are held in memory. The part must be exactly
+    `length` bytes long and match `expected_sha256` when one is given;
+    otherwise nothing is kept and a previously received copy stays in place.
+    """
+    os.makedirs(_parts_dir(upload_id), exist_ok=True)
+    path = os.path.join(_parts_dir(upload_id), f"{number}.part")
+    # A unique name per request, so an overlapping retry of the same part writes its own file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    with open(tmp_path, "wb") as f:
+        while True:
+            chunk = stream.read(min(chunk_size, length - size + 1))
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > length:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    if size != length:
+        os.remove(tmp_path)
+        raise ValueError(f"Part {number} must be {length} bytes, received {'more' if size > length else size}")
+    if expected_sha256 and digest.hexdigest() != expected_sha256.lower():
+        os.remove(tmp_path)
+        raise ValueError(f"Part {number} checksum mismatch")
+    os.replace(tmp_path, path)
+    return digest.hexdigest()
+
+
+def assemble_parts(upload_id, total_parts: int, name: str) -> dict:
+    """Concatenate the parts of a chunked upload into a spooled file and return its reference."""
+    path = _spool_path(name)
+    digest = hashlib.sha256()
+    size = 0
+    with open(f"{path}.part", "wb") as out:
+        for number in range(total_parts):
+            with open(os.path.join(_parts_dir(upload_id), f"{number}.part"), "rb") as part:
+                while True:
+                    chunk = part.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(f"{path}.part", path)
+    discard_parts(upload_id)
+    return {"path": path, "size": size, "sha256": digest.hexdigest(), "name": name}
+
+
+def discard_parts(upload_id) -> None:
+    shutil.rmtree(_parts_dir(upload_id), ignore_errors=True)
@@ -1,93 +1,220 @@
+import os
+import logging
 import cloudinary, cloudinary.uploader
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Count, Q
 from ai_tools.main import AI
-from .models import Question, Answer, Card, File, Course, Session
-from celery import shared_task
-import io, os, tempfile, requests
+from .models import Question, Answer, Card, File, Course, Session, IngestionStage
+from celery import shared_task, chain, chord, group
+from .spool import spooled_path, release
+from .progress import STAGES, create_stages, track_stage, notify
 from ai_tools.faiss_loader import SessionVectorStore
+from ai_tools.extraction_artifact import artifact_store, artifact_key
+from ai_tools.async_runner import run_async
 
-sv = SessionVectorStore()
+logger = logging.getLogger(__name__)
 
-@shared_task
-def upload_file(file_content, file_name, id):
-    cloudinary.config(secure=True)
-    file_data = cloudinary.uploader.upload(
-        io.BytesIO(file_content), resource_type="raw", 
-        access_mode="public", filename_override=file_name
-    )
+# rows per INSERT when saving generated questions, answers and cards
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+
+_vector_store = None
+
+
+def vector_store() -> SessionVectorStore:
+    """
+    The worker's vector store, built on first use.
+
+    Importing the tasks (as the web and ASGI processes do to queue them) thus
+    neither migrates the legacy index nor opens the embedding cache.
+    """
+    global _vector_store
+    if _vector_store is None:
+        # Workers only append segments, so they map the snapshot instead of loading it;
+        # the compactor is started once per worker process by `worker_process_init`.
+        _vector_store = SessionVectorStore(read_only=True, compact_interval=0)
+    return _vector_store
+
+
+def process_upload(upload, file_id):
+    """
+    Queue the ingestion of a spooled upload.
+
+    The storage upload runs first; embedding, multiple choice questions and
+    cards then run in parallel (on the workers of their queues) and
+    `finish_upload` runs once all three are done, so an upload takes about
+    as long as its slowest stage rather than the sum of them.
+    """
+    create_stages(file_id)
+    stages = group(embed_file.si(file_id), generate_questions.si(file_id), generate_cards.si(file_id))
+    return chain(upload_file.si(upload, file_id), chord(stages, finish_upload.s(file_id))).apply_async()
+
+
+def _load_artifact(_file):
+    # Reuse the parse made at upload time; only download from Cloudinary if it is gone
+    return artifact_store.get_or_build(artifact_key(_file), _file.url)
 
-    url = file_data.get("secure_url")
-    file_instance = File.objects.filter(id=id).first()
-    file_instance.url = url
-    file_instance.save()
 
-    print(file_instance.session , "my session")
-    sv.store_embeddings(url, str(file_instance.session.id))
-    generate_questions(id)
+def _get_file(file_id):
+    try:
+        return File.objects.select_related("session").get(id=file_id)
+    except ObjectDoesNotExist:
+        raise ValueError(f"No File found for id: {file_id}")
+
 
 @shared_task
-def generate_questions(file_id):
+def upload_file(upload, id):
+    """
+    `upload` is the reference returned by `spool.spool_upload`; the file is
+    read from the spool by path, so its bytes never pass through the broker.
+    """
     try:
-        # Fetch the File object
-        try:
-            _file = File.objects.get(id=file_id)
-        except ObjectDoesNotExist:
-            raise ValueError(f"No File found for session_id: {file_id}")
+        with track_stage(id, "upload"):
+            path = spooled_path(upload)
+            cloudinary.config(secure=True)
+            file_data = cloudinary.uploader.upload(
+                path, resource_type="raw",
+                access_mode="public", filename_override=upload["name"]
+            )
 
-        # Download the PDF from Cloudinary
-        res = requests.get(_file.url, stream=True)
-        if res.status_code != 200:
-            raise ValueError(f"Failed to download PDF from {_file.url}: Status {res.status_code}, Error: {res.headers.get('x-cld-error', 'No error details')}")
+            file_instance = File.objects.filter(id=id).first()
+            file_instance.url = file_data.get("secure_url")
+            file_instance.save()
 
-        # Create a temporary file for the PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-            temp_file.write(res.content)
-            temp_file_path = temp_file.name
+            # Parse the upload once, from the spooled file; every later stage reads this artifact
+            artifact = artifact_store.build(path)
+            artifact_store.put(artifact_key(file_instance), artifact)
+    finally:
+        release(upload)
 
-        try:
-            ai = AI()
+    return id
 
-            # generate a multiple choice questions and save to database
-            questions = ai.run(temp_file_path, "mutiple-choice")
+
+@shared_task
+def embed_file(file_id):
+    with track_stage(file_id, "embed"):
+        _file = _get_file(file_id)
+        artifact = _load_artifact(_file)
+        run_async(vector_store().store_embeddings(_file.url, str(_file.session.id), _file.session.user_id, artifact=artifact))
+    return len(artifact)
+
+
+@shared_task
+def generate_questions(file_id):
+    with track_stage(file_id, "questions"):
+        _file = _get_file(file_id)
+        try:
+            questions = AI().run(task="mutiple-choice", artifact=_load_artifact(_file))
             save_questions(_file.session, questions)
+        except Exception as e:
+            raise ValueError(f"Question generation failed for file {file_id}: {e}")
+    return len(questions)
+
 
-            # generate flash card questions and save to database
-            cards = ai.run(temp_file_path, "study-card")
+@shared_task
+def generate_cards(file_id):
+    with track_stage(file_id, "cards"):
+        _file = _get_file(file_id)
+        try:
+            cards = AI().run(task="study-card", artifact=_load_artifact(_file))
             save_cards(_file.session, cards)
-         
+        except Exception as e:
+            raise ValueError(f"Card generation failed for file {file_id}: {e}")
+    return len(cards)
 
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
 
-    except Exception as e:
-        error_result = {"status": "error", "message": str(e)}
-        print("Question generation failed:", error_result)
-        raise  ValueError(f"Question generation failed:  {error_result}")
+@shared_task
+def finish_upload(results, file_id):
+    chunks, questions, cards = results
+    logger.info(f"Processed file {file_id}: {chunks} chunks embedded, {questions} questions, {cards} cards")
+    notify(file_id)
+    return {"file_id": file_id, "chunks": chunks, "questions": questions, "cards": cards}
 
 
 def save_questions(session, questions):
-    for question in questions:
-        question2 = Question.objects.create(
-                question_text=question.get('questionText'),
-                session=session
-            )
-        for ans in question.get("answers"):
-            Answer.objects.create(
-                content=ans.get('text'),
-                is_correct=ans.get('isCorrect'),
-                question=question2
-            )
+    """Insert generated questions and their answers in bulk, in one transaction."""
+    with transaction.atomic():
+        new_questions = Question.objects.bulk_create(
+            [Question(question_text=question.get('questionText'), session=session) for question in questions],
+            batch_size=BULK_BATCH_SIZE,
+        )
+        # bulk_create sets the primary keys, so the answers can point at their questions
+        Answer.objects.bulk_create([
+            Answer(content=ans.get('text'), is_correct=ans.get('isCorrect'), question=new_question)
+            for question, new_question in zip(questions, new_questions)
+            for ans in question.get("answers")
+        ], batch_size=BULK_BATCH_SIZE)
 
 def save_cards(session, cards):
-    for card in cards:
-        question2 = Card.objects.create(
-            question=card.get('question'),
-            session=session,
-            answer=card.get('answer')
-        )
+    with transaction.atomic():
+        Card.objects.bulk_create([
+            Card(question=card.get('question'), session=session, answer=card.get('answer')) for card in cards
+        ], batch_size=BULK_BATCH_SIZE)
+
+
+def find_duplicate(content_hash):
+    """Return the earliest File with the same content whose every ingestion stage is done, or None."""
+    if not content_hash:
+        return None
+    return (
+        File.objects.filter(content_hash=content_hash)
+        .exclude(url="")
+        # stages run in parallel, so material alone does not mean the vectors exist yet
+        .annotate(done_stages=Count("stages", filter=Q(stages__status=IngestionStage.Status.DONE)))
+        .filter(done_stages=len(STAGES))
+        .select_related("session")
+        .order_by("created_at")
+        .first()
+    )
+
+
+def copy_study_material(source, target):
+    """Copy the questions, answers and cards generated for one session to another."""
+    questions = list(source.questions.prefetch_related("answers"))
+    new_questions = Question.objects.bulk_create(
+        [Question(session=target, question_text=question.question_text) for question in questions],
+        batch_size=BULK_BATCH_SIZE,
+    )
+    Answer.objects.bulk_create([
+        Answer(question=new_question, content=answer.content, is_correct=answer.is_correct)
+        for question, new_question in zip(questions, new_questions)
+        for answer in question.answers.all()
+    ], batch_size=BULK_BATCH_SIZE)
+    Card.objects.bulk_create([
+        Card(session=target, question=card.question, answer=card.answer) for card in source.cards.all()
+    ], batch_size=BULK_BATCH_SIZE)
+
+
+@shared_task
+def reuse_document(source_file_id, file_id, upload):
+    """
+    Finish a duplicate upload from the work already done for another File.
+
+    The new File points at the same stored document, the session gets copies
+    of the generated study material, and its vectors are an alias of the
+    source session's, so no extraction, embedding or LLM call is needed.
+    When the source's vectors cannot be shared, or the target session already
+    has vectors of its own, the spooled `upload` is processed as a new
+    document instead.
+    """
+    source_file = _get_file(source_file_id)
+    file_instance = _get_file(file_id)
+    other_session = source_file.session_id != file_instance.session_id
+    if other_session and not vector_store().alias_session(str(source_file.session_id), str(file_instance.session_id)):
+        logger.warning(f"Cannot reuse file {source_file.id} for file {file_instance.id}, processing it again")
+        process_upload(upload, file_instance.id)
+        return
+
+    release(upload)
+    with transaction.atomic():
+        file_instance.url = source_file.url
+        file_instance.save(update_fields=["url", "updated_at"])
+        if other_session:
+            copy_study_material(source_file.session, file_instance.session)
+
+    create_stages(file_instance.id, status=IngestionStage.Status.DONE)
+    notify(file_instance.id)
 
 
 # def generate_mutiple_questions(course):
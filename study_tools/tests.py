@@ -1,3 +1,231 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from UserAccountManager.models import User
+from .models import Session, Question, Answer, Card, File, ChunkedUpload, IngestionStage
+from .progress import create_stages
+from . import task
+from .serializers import create_file
 
-# Create your tests here.
+
+class StudyMaterialListTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="owner@example.com", password="password")
+        cls.other_user = User.objects.create(email="other@example.com", password="password")
+        cls.session = Session.objects.create(user=cls.user, name="session")
+        cls.other_session = Session.objects.create(user=cls.other_user, name="other session")
+
+        for session in (cls.session, cls.other_session):
+            questions = Question.objects.bulk_create(
+                [Question(session=session, question_text=f"question {i}") for i in range(20)]
+            )
+            Answer.objects.bulk_create([
+                Answer(question=question, content=f"answer {j}", is_correct=j == 0)
+                for question in questions for j in range(4)
+            ])
+            Card.objects.bulk_create(
+                [Card(session=session, question=f"card {i}", answer="answer") for i in range(20)]
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.data
+
+    def test_questions_are_scoped_to_the_session(self):
+        _, data = self.count_queries(f"/sessions/{self.session.id}/questions?page_size=50")
+        self.assertEqual(len(data["results"]), 20)
+        self.assertEqual(len(data["results"][0]["answers"]), 4)
+
+    def test_other_users_session_is_empty(self):
+        _, data = self.count_queries(f"/sessions/{self.other_session.id}/questions")
+        self.assertEqual(data["results"], [])
+        _, data = self.count_queries(f"/sessions/{self.other_session.id}/cards")
+        self.assertEqual(data["results"], [])
+
+    def test_question_query_count_does_not_depend_on_page_size(self):
+        small, _ = self.count_queries(f"/sessions/{self.session.id}/questions?page_size=2")
+        large, _ = self.count_queries(f"/sessions/{self.session.id}/questions?page_size=20")
+        self.assertEqual(small, large)
+
+    def test_card_query_count_does_not_depend_on_page_size(self):
+        small, _ = self.count_queries(f"/sessions/{self.session.id}/cards?page_size=2")
+        large, _ = self.count_queries(f"/sessions/{self.session.id}/cards?page_size=20")
+        self.assertEqual(small, large)
+
+    def test_cursor_pages_are_stable_while_rows_are_added(self):
+        _, data = self.count_queries(f"/sessions/{self.session.id}/cards?page_size=15")
+        seen = [card["question"] for card in data["results"]]
+        Card.objects.create(session=self.session, question="card 20", answer="answer")
+        _, data = self.count_queries(data["next"])
+        seen += [card["question"] for card in data["results"]]
+        self.assertEqual(seen, [f"card {i}" for i in range(21)])
+
+
+class ChunkedUploadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="owner@example.com", password="password")
+        cls.session = Session.objects.create(user=cls.user, name="session")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+        for patcher in (
+            mock.patch("study_tools.spool.UPLOAD_SPOOL_DIR", self.spool_dir),
+            mock.patch("study_tools.serializers.CHUNKED_UPLOAD_PART_SIZE", 4),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.process_upload = mock.patch("study_tools.serializers.process_upload").start()
+        self.addCleanup(mock.patch.stopall)
+        self.data = b"0123456789"
+
+    def start(self, **fields):
+        body = {"session": self.session.id, "file_name": "notes.pdf", "size": len(self.data), **fields}
+        response = self.client.post("/sessions/uploads/chunked/", body, format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def put_part(self, upload_id, number, body, sha256=None):
+        headers = {"HTTP_X_PART_SHA256": sha256} if sha256 else {}
+        return self.client.generic(
+            "PUT", f"/sessions/uploads/chunked/{upload_id}/parts/{number}", body,
+            content_type="application/octet-stream", **headers,
+        )
+
+    def complete(self, upload_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f"/sessions/uploads/chunked/{upload_id}/complete")
+
+    def test_start_reports_parts(self):
+        upload_id = self.start()
+        response = self.client.get(f"/sessions/uploads/chunked/{upload_id}")
+        self.assertEqual(response.data["total_parts"], 3)
+        self.assertEqual(response.data["received_parts"], [])
+
+    def test_start_rejects_another_users_session(self):
+        other = User.objects.create(email="other@example.com", password="password")
+        session = Session.objects.create(user=other, name="other")
+        response = self.client.post(
+            "/sessions/uploads/chunked/", {"session": session.id, "file_name": "a.pdf", "size": 10}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_resume_and_complete(self):
+        upload_id = self.start(sha256=hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self.put_part(upload_id, 0, self.data[:4]).status_code, 200)
+        self.assertEqual(self.put_part(upload_id, 2, self.data[8:]).status_code, 200)
+
+        # an interrupted client asks which parts arrived and sends the rest
+        response = self.client.get(f"/sessions/uploads/chunked/{upload_id}")
+        self.assertEqual(response.data["received_parts"], [0, 2])
+        response = self.complete(upload_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["missing_parts"], [1])
+
+        self.assertEqual(self.put_part(upload_id, 1, self.data[4:8]).status_code, 200)
+        response = self.complete(upload_id)
+        self.assertEqual(response.status_code, 201)
+
+        file = File.objects.get(id=response.data["file"])
+        self.assertEqual(file.content_hash, hashlib.sha256(self.data).hexdigest())
+        upload, file_id = self.process_upload.call_args[0]
+        self.assertEqual(file_id, file.id)
+        with open(upload["path"], "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+        # completing again is idempotent and parts are no longer accepted
+        self.assertEqual(self.complete(upload_id).data["file"], file.id)
+        self.assertEqual(self.put_part(upload_id, 0, self.data[:4]).status_code, 409)
+        self.assertEqual(self.process_upload.call_count, 1)
+
+    def test_part_checksum_and_length_are_checked(self):
+        upload_id = self.start()
+        self.assertEqual(self.put_part(upload_id, 0, self.data[:4], sha256="0" * 64).status_code, 400)
+        self.assertEqual(self.put_part(upload_id, 0, self.data[:3]).status_code, 400)
+        self.assertEqual(self.put_part(upload_id, 0, b"").status_code, 400)
+        self.assertEqual(self.put_part(upload_id, 3, b"x").status_code, 400)
+        sha256 = hashlib.sha256(self.data[:4]).hexdigest()
+        self.assertEqual(self.put_part(upload_id, 0, self.data[:4], sha256=sha256).status_code, 200)
+        self.assertEqual(ChunkedUpload.objects.get(id=upload_id).parts, {"0": sha256})
+
+    def test_file_checksum_mismatch_discards_parts(self):
+        upload_id = self.start(sha256="0" * 64)
+        for number in range(3):
+            self.put_part(upload_id, number, self.data[number * 4:number * 4 + 4])
+        response = self.complete(upload_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ChunkedUpload.objects.get(id=upload_id).parts, {})
+        self.assertFalse(File.objects.exists())
+        self.process_upload.assert_not_called()
+        self.assertEqual(os.listdir(os.path.join(self.spool_dir, "parts")), [])
+
+
+class DuplicateUploadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email="owner@example.com", password="password")
+        cls.source_session = Session.objects.create(user=cls.user, name="source")
+        cls.session = Session.objects.create(user=cls.user, name="target")
+        cls.source = File.objects.create(session=cls.source_session, url="https://example.com/a.pdf", content_hash="a" * 64)
+        Card.objects.create(session=cls.source_session, question="card", answer="answer")
+
+    def setUp(self):
+        self.upload = {"path": "/spool/a.pdf", "size": 1, "sha256": "a" * 64, "name": "a.pdf"}
+        self.target = File.objects.create(session=self.session, content_hash="a" * 64)
+        for name in ("vector_store", "process_upload", "release", "notify"):
+            patcher = mock.patch.object(task, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_source_with_unfinished_stages_is_not_a_duplicate(self):
+        create_stages(self.source.id)
+        IngestionStage.objects.filter(file=self.source).exclude(name="embed").update(status="done")
+        self.assertIsNone(task.find_duplicate("a" * 64))
+        IngestionStage.objects.filter(file=self.source, name="embed").update(status="done")
+        self.assertEqual(task.find_duplicate("a" * 64), self.source)
+
+    def test_duplicate_upload_is_reused_by_a_worker_after_commit(self):
+        create_stages(self.source.id, status=IngestionStage.Status.DONE)
+        with mock.patch("study_tools.serializers.reuse_document") as reuse_document:
+            with self.captureOnCommitCallbacks() as callbacks:
+                instance = create_file(self.upload, session=self.session)
+            reuse_document.delay.assert_not_called()
+            for callback in callbacks:
+                callback()
+        reuse_document.delay.assert_called_once_with(self.source.id, instance.id, self.upload)
+        self.vector_store.assert_not_called()
+
+    def test_reuse_copies_material_and_aliases_vectors(self):
+        self.vector_store.return_value.alias_session.return_value = True
+        task.reuse_document(self.source.id, self.target.id, self.upload)
+        self.release.assert_called_once_with(self.upload)
+        self.process_upload.assert_not_called()
+        self.assertEqual(self.session.cards.count(), 1)
+        self.assertEqual(set(self.target.stages.values_list("status", flat=True)), {"done"})
+
+    def test_reuse_without_source_vectors_processes_the_upload(self):
+        self.vector_store.return_value.alias_session.return_value = False
+        task.reuse_document(self.source.id, self.target.id, self.upload)
+        self.process_upload.assert_called_once_with(self.upload, self.target.id)
+        self.release.assert_not_called()
+        self.assertFalse(self.session.cards.exists())
+        self.assertFalse(self.target.stages.exists())
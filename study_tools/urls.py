@@ -4,6 +4,11 @@ from .views import *
 urlpatterns = [
     # file upload url
     path("uploads/", FileCreateView.as_view(), name='create-document'),
+    path("uploads/<int:id>/status", FileStatusView.as_view(), name='document-status'),
+    path("uploads/chunked/", ChunkedUploadCreateView.as_view(), name='create-chunked-upload'),
+    path("uploads/chunked/<uuid:upload_id>", ChunkedUploadDetailView.as_view(), name='chunked-upload'),
+    path("uploads/chunked/<uuid:upload_id>/parts/<int:number>", ChunkedUploadPartView.as_view(), name='chunked-upload-part'),
+    path("uploads/chunked/<uuid:upload_id>/complete", ChunkedUploadCompleteView.as_view(), name='complete-chunked-upload'),
     path("", SessionListView.as_view(), name='list-sessions'),
     path("<int:id>/questions", QuestionListView.as_view(), name="retrieve-questions"),
     path("<int:id>/cards", CardListView.as_view(), name="retrieve-cards"),
@@ -3,10 +3,12 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.exceptions import PermissionDenied
-from rest_framework.pagination import LimitOffsetPagination
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from .serializers import *
-from .models import Course, Session, File
+from .pagination import NewestFirstPagination, OldestFirstPagination
+from .models import Course, Session, File, ChunkedUpload
+from .spool import write_part, assemble_parts, discard_parts, release
 
 
 
@@ -71,29 +73,131 @@ class FileCreateView(generics.CreateAPIView):
     serializer_class = FileSerializer
 
 
+class FileStatusView(generics.RetrieveAPIView):
+    """Progress of each processing stage of an upload; the same data is pushed on study/uploads/."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = FileStatusSerializer
+    lookup_field = 'id'
+
+    def get_queryset(self):
+        return File.objects.filter(session__user=self.request.user).prefetch_related('stages')
+
+
+class ChunkedUploadCreateView(generics.CreateAPIView):
+    """Start a resumable upload; the response lists the part size and number of parts to send."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = ChunkedUploadSerializer
+
+
+class ChunkedUploadDetailView(generics.RetrieveDestroyAPIView):
+    """Report which parts were received so an interrupted client can resume, or abort the upload."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = ChunkedUploadSerializer
+    lookup_field = 'id'
+    lookup_url_kwarg = 'upload_id'
+
+    def get_queryset(self):
+        return ChunkedUpload.objects.filter(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        discard_parts(instance.id)
+        instance.delete()
+
+
+class ChunkedUploadPartView(APIView):
+    """
+    PUT the raw bytes of one part (numbered from 0).
+
+    The body is streamed to disk rather than parsed, so only a small buffer
+    is held in memory. An optional X-Part-SHA256 header is verified; a part
+    can be re-sent until the upload is completed.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, upload_id, number):
+        upload = get_object_or_404(ChunkedUpload, id=upload_id, user=request.user)
+        if upload.file_id:
+            return Response({"error": "upload already completed"}, status=status.HTTP_409_CONFLICT)
+        if not 0 <= number < upload.total_parts:
+            return Response({"error": f"part must be between 0 and {upload.total_parts - 1}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.stream is None:
+            return Response({"error": "empty part"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            sha256 = write_part(
+                upload.id, number, request.stream, upload.part_length(number),
+                expected_sha256=request.headers.get("X-Part-SHA256", ""),
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Parts may arrive concurrently; record each one under a row lock
+        with transaction.atomic():
+            upload = ChunkedUpload.objects.select_for_update().get(id=upload.id)
+            upload.parts[str(number)] = sha256
+            upload.save(update_fields=["parts", "updated_at"])
+
+        return Response({"part": number, "sha256": sha256}, status=status.HTTP_200_OK)
+
+
+class ChunkedUploadCompleteView(APIView):
+    """Assemble the received parts and process the file like a regular upload."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        with transaction.atomic():
+            upload = get_object_or_404(ChunkedUpload.objects.select_for_update(), id=upload_id, user=request.user)
+            if upload.file_id:
+                return Response({"file": upload.file_id}, status=status.HTTP_200_OK)
+
+            missing = [number for number in range(upload.total_parts) if str(number) not in upload.parts]
+            if missing:
+                return Response({"error": "missing parts", "missing_parts": missing}, status=status.HTTP_400_BAD_REQUEST)
+
+            assembled = assemble_parts(upload.id, upload.total_parts, upload.file_name)
+            if upload.sha256 and assembled["sha256"] != upload.sha256.lower():
+                release(assembled)
+                upload.parts = {}
+                upload.save(update_fields=["parts", "updated_at"])
+                return Response({"error": "file checksum mismatch, upload the parts again"}, status=status.HTTP_400_BAD_REQUEST)
+
+            upload.file = create_file(assembled, session=upload.session)
+            upload.save(update_fields=["file", "updated_at"])
+
+        return Response({"file": upload.file_id}, status=status.HTTP_201_CREATED)
+
+
 class SessionListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = SessionSerializer
+    pagination_class = NewestFirstPagination
 
     def get_queryset(self):
         user = self.request.user 
-        return Session.objects.filter(user=user).order_by('-created_at')
+        return Session.objects.filter(user=user)
 
 
 class QuestionListView(generics.ListAPIView):
-    queryset = Question.objects.all()
     permission_classes = [IsAuthenticated]
     serializer_class = QuestionSerializer
-    pagination_class = LimitOffsetPagination
-    lookup_field = "session__id"
+    pagination_class = OldestFirstPagination
+
+    def get_queryset(self):
+        # answers are fetched in one query per page rather than one per question
+        return (
+            Question.objects.filter(session__id=self.kwargs['id'], session__user=self.request.user)
+            .prefetch_related('answers')
+        )
 
 
 class CardListView(generics.ListAPIView):
-    queryset = Card.objects.all()
     permission_classes = [IsAuthenticated]
     serializer_class = CardSerializer
-    pagination_class = LimitOffsetPagination
-    lookup_field = "session__id"
+    pagination_class = OldestFirstPagination
+
+    def get_queryset(self):
+        return Card.objects.filter(session__id=self.kwargs['id'], session__user=self.request.user)
 
 
 
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 from django.conf import settings
 
 
@@ -13,4 +14,20 @@ app.autodiscover_tasks()
 
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    from ai_tools.pdf_extraction import enable_process_pool
+    from study_tools.task import vector_store
+    # Large PDFs are extracted in parallel only in workers, never in the web or ASGI processes
+    enable_process_pool()
+    # Likewise for compaction; overlapping compactors of sibling workers skip while one holds the lock
+    vector_store().start_compactor()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    from ai_tools.pdf_extraction import close_process_pool
+    close_process_pool()
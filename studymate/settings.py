@@ -141,6 +141,14 @@ CHANNEL_LAYERS = {
 
 # Celery settings
 CELERY_BROKER_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}/0'
+# chords need a result backend to know when every stage of an upload is done
+CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}:{REDIS_PORT}/1'
+# embedding and LLM stages run on their own queues so separate workers can take them in parallel
+CELERY_TASK_ROUTES = {
+    'study_tools.task.embed_file': {'queue': 'embedding'},
+    'study_tools.task.generate_questions': {'queue': 'llm'},
+    'study_tools.task.generate_cards': {'queue': 'llm'},
+}
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases